@@ -0,0 +1,478 @@
+import datetime, hashlib, json, os, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple
+from cache import ResponseCache, response_key
+from llm import count_tokens
+from metrics import Metrics
+
+
+# Local copies of batch files (inputs, outputs and errors, for checking), elsewhere for benchmarks
+batch_folder = os.getenv("OBJECTIVE_BATCH_FOLDER", "../batch_files")
+
+# Registry of the batch jobs created (one JSON record by line, the last record of a job wins)
+registry_path = f"{batch_folder}/registry.jsonl"
+
+# Size of the chunks of downloaded files
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Exit code of a stage stopped once its batch is submitted (OBJECTIVE_BATCH_SUBMIT_ONLY=yes, see run-batches.py)
+SUBMITTED_EXIT_CODE = 75
+
+
+class JobStatus(NamedTuple):
+    """State of a batch job, whatever the provider."""
+    status: str
+    running: bool
+    succeeded: int
+    failed: int
+    total: int
+    output_file: str | None
+    error_file: str | None
+
+
+class MistralAdapter:
+    """Batch API of MistralAI."""
+
+    provider = "mistralai"
+
+    # Limits of a batch job (bigger batches are split in shards)
+    max_requests = 1_000_000
+    max_bytes = 500 * 1024 * 1024
+
+    def __init__(self, client, model: str, endpoint: str = "/v1/chat/completions") -> None:
+        self.client = client
+        self.model = model
+        self.endpoint = endpoint
+
+    def upload(self, input_path: str) -> str:
+        with open(input_path, 'rb') as file:
+            file_infos = self.client.files.upload(file={"file_name": os.path.basename(input_path), "content": file}, purpose="batch")
+        return file_infos.id
+
+    def create(self, file_id: str, task_name: str) -> str:
+        batch_job = self.client.batch.jobs.create(input_files=[file_id], model=self.model, endpoint=self.endpoint, metadata={"task": task_name})
+        return batch_job.id
+
+    def status(self, job_id: str) -> JobStatus:
+        batch_job = self.client.batch.jobs.get(job_id=job_id)
+        return JobStatus(
+            batch_job.status, batch_job.status in ["QUEUED", "RUNNING"],
+            batch_job.succeeded_requests, batch_job.failed_requests, batch_job.total_requests,
+            batch_job.output_file, batch_job.error_file
+        )
+
+    def download(self, file_id: str, path: str) -> None:
+        response = self.client.files.download(file_id=file_id)
+        with open(path, 'wb') as file:
+            for chunk in response.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+                file.write(chunk)
+
+
+class OpenAIAdapter:
+    """Batch API of OpenAI."""
+
+    provider = "openai"
+
+    # Limits of a batch job (bigger batches are split in shards)
+    max_requests = 50_000
+    max_bytes = 190 * 1024 * 1024
+
+    def __init__(self, client, model: str, endpoint: str = "/v1/chat/completions") -> None:
+        self.client = client
+        self.model = model # Given by each task, kept for the response cache
+        self.endpoint = endpoint
+
+    def upload(self, input_path: str) -> str:
+        with open(input_path, 'rb') as file:
+            file_infos = self.client.files.create(file=file, purpose='batch')
+        return file_infos.id
+
+    def create(self, file_id: str, task_name: str) -> str:
+        batch_job = self.client.batches.create(input_file_id=file_id, completion_window="24h", endpoint=self.endpoint, metadata={"job_type": task_name})
+        return batch_job.id
+
+    def status(self, job_id: str) -> JobStatus:
+        batch_job = self.client.batches.retrieve(job_id)
+        counts = batch_job.request_counts
+        return JobStatus(
+            batch_job.status, batch_job.status in ["validating", "in_progress", "finalizing", "cancelling"],
+            counts.completed if counts else 0, counts.failed if counts else 0, counts.total if counts else 0,
+            batch_job.output_file_id, batch_job.error_file_id
+        )
+
+    def download(self, file_id: str, path: str) -> None:
+        with self.client.files.with_streaming_response.content(file_id) as response:
+            with open(path, 'wb') as file:
+                for chunk in response.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    file.write(chunk)
+
+
+def adapter(provider: str, client, model: str, endpoint: str = "/v1/chat/completions"):
+    """Batch adapter of the given LLM provider: a new provider only needs its limits and upload / create / status / download."""
+    if provider == "mistralai": return MistralAdapter(client, model, endpoint)
+    if provider == "openai": return OpenAIAdapter(client, model, endpoint)
+    raise Exception(f'Batch not implemented with {provider}')
+
+
+def parse_result(result: dict) -> Tuple[str, str | None]:
+    """(custom_id, answer) of a line of an output file (the answer is None if the request failed)."""
+    response = result.get('response') or {}
+    if result.get('error') or response.get('status_code', 200) != 200:
+        return result['custom_id'], None
+    return result['custom_id'], response['body']['choices'][0]['message']['content']
+
+
+def parse_usage(result: dict) -> Tuple[str | None, Tuple[int, int] | None]:
+    """(model, (input tokens, output tokens)) of a line of an output file, as given by the provider (None if missing)."""
+    body = (result.get('response') or {}).get('body') or {}
+    usage = body.get('usage') or {}
+    if 'prompt_tokens' not in usage: return body.get('model'), None
+    return body.get('model'), (usage['prompt_tokens'], usage.get('completion_tokens', 0))
+
+
+class BatchRegistry:
+    """
+    Local record of the batch jobs: task name, catalog, input hash, shard, job id, state and files.
+    A job can then be found again from its input (same task and same tasks), for instance after a crash while polling,
+    instead of paying for a new one. States: submitted, finished, downloaded, failed (finished without output),
+    rejected (answers found invalid by the stage, see reject): failed and rejected jobs are never reattached.
+    """
+
+    def __init__(self, path: str = registry_path) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+
+    def entries(self) -> Dict[str, dict]:
+        """{job id: last record of the job}"""
+        entries = {}
+        if not os.path.exists(self.path): return entries
+        with open(self.path, 'r') as file:
+            for line in file:
+                try: entry = json.loads(line)
+                except json.JSONDecodeError: continue
+                entries[entry['job_id']] = entry
+        return entries
+
+    def find(self, task_name: str, input_hash: str | None = None) -> Dict[int, dict]:
+        """
+        {shard index: last job} of the given task and input which did not fail (and was not rejected).
+        Without input hash, the jobs of the last input of the task are given.
+        """
+        entries = [entry for entry in self.entries().values() if entry['task_name'] == task_name]
+        if input_hash is None:
+            if len(entries) == 0: return {}
+            input_hash = entries[-1]['input_hash']
+        shards = {}
+        for entry in entries:
+            if entry['input_hash'] == input_hash and entry['state'] not in ['failed', 'rejected']:
+                shards[entry.get('shard', 0)] = entry
+        return shards
+
+    def reject(self, task_name: str, custom_ids: Iterable[str]) -> int:
+        """
+        Reject the jobs of the last input of the task which have one of the given tasks (answers the stage could not use),
+        so that running the stage again asks them again instead of reattaching to the same answers. Return their number.
+        """
+        custom_ids = set(custom_ids)
+        rejected = []
+        for entry in self.find(task_name).values():
+            if not os.path.exists(entry['input_path']): continue
+            with open(entry['input_path'], 'r') as file:
+                if any(json.loads(line)['custom_id'] in custom_ids for line in file if line.strip() != ''):
+                    rejected.append({ **entry, "state": "rejected", "date": datetime.datetime.now().isoformat(timespec='seconds') })
+        with self.lock:
+            with open(self.path, 'a') as file:
+                for entry in rejected:
+                    file.write(json.dumps(entry) + "\n")
+        return len(rejected)
+
+    def record(self, job: 'BatchJob', shard: 'Shard') -> None:
+        entry = {
+            "task_name": job.task_name,
+            "catalog": job.catalog,
+            "input_hash": job.input_hash,
+            "shard": shard.index,
+            "nb_shards": len(job.shards),
+            "job_id": shard.job_id,
+            "state": shard.state,
+            "status": shard.status.status if shard.status else None,
+            "nb_tasks": shard.nb_tasks,
+            "input_path": shard.input_path,
+            "output_path": shard.output_path,
+            "error_path": shard.error_path,
+            "date": datetime.datetime.now().isoformat(timespec='seconds'),
+        }
+        with self.lock:
+            with open(self.path, 'a') as file:
+                file.write(json.dumps(entry) + "\n")
+
+
+class Shard:
+    """Part of a batch small enough for the provider limits, executed as one job."""
+
+    def __init__(self, index: int, path: str) -> None:
+        self.index = index
+        self.input_path = path.replace('{kind}', 'input')
+        self.output_path = path.replace('{kind}', 'output')
+        self.error_path = path.replace('{kind}', 'error')
+        self.nb_tasks = 0
+        self.nb_bytes = 0
+        self.job_id = None
+        self.state = None
+        self.status = None
+
+    def done(self) -> bool:
+        return self.state == 'failed' or (self.state == 'downloaded' and os.path.exists(self.output_path))
+
+
+class BatchJob:
+    """
+    A batch of chat requests: tasks are written to JSONL files, uploaded, executed by the provider,
+    and the results are downloaded to disk and read back line by line. Memory stays flat whatever the batch size.
+    Tasks beyond the provider limits (number of requests, file size) go to other shards, each one being a job.
+    """
+
+    def __init__(self, adapter, task_name: str, catalog: str | None = None) -> None:
+        self.adapter = adapter
+        self.task_name = task_name
+        self.catalog = catalog
+        self.registry = BatchRegistry()
+        self.nb_tasks = 0
+        self.input_hash = None
+        self.shards: List[Shard] = []
+
+        if not os.path.exists(batch_folder): os.mkdir(batch_folder)
+        self.now_str = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M")
+
+    def _new_shard(self) -> Shard:
+        suffix = f"_part{len(self.shards) + 1}" if len(self.shards) > 0 else ""
+        shard = Shard(len(self.shards), f"{batch_folder}/{self.task_name}_{{kind}}_{self.now_str}{suffix}.jsonl")
+        self.shards.append(shard)
+        return shard
+
+    def write(self, tasks: Iterable[dict]) -> int:
+        """Write the tasks in the input files (and hash them). Tasks can be a generator: they are written as they come."""
+        print('Creating the batch file...')
+        self.nb_tasks = 0
+        input_hash = hashlib.sha256()
+        shard = self._new_shard()
+        file = open(shard.input_path, "w")
+        for task in tasks:
+            line = json.dumps(task) + "\n"
+            nb_bytes = len(line.encode())
+            if shard.nb_tasks > 0 and (shard.nb_tasks >= self.adapter.max_requests or shard.nb_bytes + nb_bytes > self.adapter.max_bytes):
+                file.close()
+                shard = self._new_shard()
+                file = open(shard.input_path, "w")
+            file.write(line)
+            input_hash.update(line.encode())
+            shard.nb_tasks += 1
+            shard.nb_bytes += nb_bytes
+            self.nb_tasks += 1
+        file.close()
+        self.input_hash = input_hash.hexdigest()
+        print(f'{self.nb_tasks} tasks written in <{self.shards[0].input_path}>' + (f' and {len(self.shards) - 1} other shards' if len(self.shards) > 1 else ''))
+        return self.nb_tasks
+
+    def reattach(self) -> int:
+        """Take over the shards already submitted with the same input, if any, and return their number."""
+        entries = self.registry.find(self.task_name, self.input_hash)
+        for shard in self.shards:
+            entry = entries.get(shard.index)
+            if entry is None: continue
+            if entry['input_path'] != shard.input_path and os.path.exists(shard.input_path): os.remove(shard.input_path)
+            shard.job_id, shard.state = entry['job_id'], entry['state']
+            shard.input_path, shard.output_path, shard.error_path = entry['input_path'], entry['output_path'], entry['error_path']
+            print(f'Same input as batch job {shard.job_id} ({entry["state"]}, {entry["date"]}), reattaching to it')
+        return len([shard for shard in self.shards if shard.job_id is not None])
+
+    @staticmethod
+    def load(adapter, task_name: str) -> 'BatchJob | None':
+        """Job of the last input of the given task, as recorded in the registry (None if there is none)."""
+        entries = BatchRegistry().find(task_name)
+        if len(entries) == 0: return None
+        entry = next(iter(entries.values()))
+        job = BatchJob(adapter, task_name, entry['catalog'])
+        job.input_hash = entry['input_hash']
+        for index in range(entry['nb_shards']):
+            job._new_shard()
+        job.reattach()
+        return job
+
+    def _submit_shard(self, shard: Shard) -> None:
+        file_id = self.adapter.upload(shard.input_path)
+        shard.job_id = self.adapter.create(file_id, self.task_name)
+        shard.state = 'submitted'
+        self.registry.record(self, shard)
+
+    def submit(self) -> None:
+        """Upload and create the jobs of the shards not submitted yet, in parallel."""
+        shards = [shard for shard in self.shards if shard.job_id is None]
+        if len(shards) == 0: return
+        print(f'Uploading the batch file{"s" if len(shards) > 1 else ""} and creating the batch job{"s" if len(shards) > 1 else ""}...')
+        with ThreadPoolExecutor(max_workers=min(8, len(shards))) as pool:
+            list(pool.map(self._submit_shard, shards))
+
+    def poll_shard(self, shard: Shard) -> None:
+        """Refresh the status of a shard, and download its results once it is over."""
+        if shard.state != 'downloaded':
+            shard.status = self.adapter.status(shard.job_id)
+            if shard.status.running: return
+            print(f"Batch job {shard.job_id} completed with status: {shard.status.status}")
+            shard.state = 'finished' if shard.status.output_file else 'failed'
+            self.registry.record(self, shard)
+        self.download(shard)
+
+    def download(self, shard: Shard) -> None:
+        """Download the output (and error) files of a shard, straight to disk."""
+        if shard.status is None: shard.status = self.adapter.status(shard.job_id)
+        if shard.status.error_file:
+            print('Downloading result error file...')
+            self.adapter.download(shard.status.error_file, shard.error_path)
+            print(f'Some requests failed, see error file <{shard.error_path}> for more information.')
+        if shard.status.output_file:
+            print('Downloading result output file...')
+            self.adapter.download(shard.status.output_file, shard.output_path)
+            shard.state = 'downloaded'
+            self.registry.record(self, shard)
+
+    def running_shards(self) -> List[Shard]:
+        return [shard for shard in self.shards if shard.job_id is not None and not shard.done()]
+
+    def done(self) -> bool:
+        return all(shard.done() for shard in self.shards)
+
+    def wait(self) -> None:
+        """Poll the jobs until they are over (and downloaded)."""
+        for _ in Poller([self]).run(): pass
+
+    def results(self, metrics: Metrics | None = None) -> Iterator[Tuple[str, str]]:
+        """Yield the (custom_id, answer) of the output files, in file order. Failed requests are left out (and recorded, as others)."""
+        failed_shards = [shard for shard in self.shards if shard.state == 'failed']
+        if len(failed_shards) == len(self.shards) and self.nb_tasks > 0:
+            raise Exception(f'Batch job {failed_shards[0].job_id} has no output, see <{failed_shards[0].error_path}> if any.')
+        for shard in failed_shards:
+            print(f'WARNING: batch job {shard.job_id} has no output ({shard.nb_tasks} tasks), see <{shard.error_path}> if any.')
+
+        nb_failed = 0
+        for shard in self.shards:
+            if shard.state != 'downloaded': continue
+            with open(shard.output_path, 'r') as file:
+                for line in file:
+                    if line.strip() == '': continue
+                    result = json.loads(line)
+                    custom_id, answer = parse_result(result)
+                    if metrics is not None:
+                        model, usage = parse_usage(result)
+                        input_tokens, output_tokens, estimated = count_tokens([], answer, usage)
+                        metrics.request(
+                            self.adapter.provider, model or self.adapter.model, 'batch', None,
+                            input_tokens, output_tokens, estimated, failed=answer is None
+                        )
+                    if answer is None:
+                        nb_failed += 1
+                        continue
+                    yield custom_id, answer
+        if nb_failed > 0:
+            print(f'{nb_failed} failed requests in the output files of {self.task_name}')
+
+
+class Poller:
+    """
+    Poll the jobs of many batches at once (one status request by running shard and by round, less and less often),
+    download the results of each shard as soon as it is over, and give back each batch once all its shards are there.
+    """
+
+    def __init__(self, jobs: Iterable[BatchJob] = (), poll_delay: float = 2, max_poll_delay: float = 60, workers: int = 8) -> None:
+        self.jobs = list(jobs)
+        self.poll_delay = poll_delay
+        self.max_poll_delay = max_poll_delay
+        self.workers = workers
+
+    def run(self) -> Iterator[BatchJob]:
+        """Yield the batches in the order they are over."""
+        pending = list(self.jobs)
+        delay = self.poll_delay
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while len(pending) > 0:
+                shards = [(job, shard) for job in pending for shard in job.running_shards()]
+                list(pool.map(lambda job_shard: job_shard[0].poll_shard(job_shard[1]), shards))
+
+                for job in [job for job in pending if job.done()]:
+                    pending.remove(job)
+                    yield job
+                if len(pending) == 0: break
+
+                # Progress of all running shards
+                statuses = [shard.status for job in pending for shard in job.shards if shard.status is not None]
+                nb_succ, nb_fail = sum(status.succeeded for status in statuses), sum(status.failed for status in statuses)
+                nb_total = sum(status.total for status in statuses)
+                advancement = round(100 * (nb_succ + nb_fail) / nb_total) if nb_total else 0
+                infos = f'> {len(pending)} batches running - Failed: {nb_fail} - Successful: {nb_succ} - Advancement: {advancement}%                  '
+                print(infos, end="\r")
+                time.sleep(delay)
+                delay = min(self.max_poll_delay, delay * 1.5)
+
+
+def reject(task_name: str, custom_ids: Iterable[str]) -> None:
+    """Do not reattach to the jobs of the given tasks when the task is executed again (see BatchRegistry.reject)."""
+    nb_rejected = BatchRegistry().reject(task_name, custom_ids)
+    if nb_rejected > 0:
+        print(f'{nb_rejected} batch job{"s" if nb_rejected > 1 else ""} of {task_name} rejected, {"they" if nb_rejected > 1 else "it"} will not be reattached')
+
+
+def execute(
+        tasks: Iterable[dict], adapter, task_name: str, catalog: str | None = None, reattach: bool = True,
+        cache: ResponseCache | None = None, metrics: Metrics | None = None
+    ) -> Iterator[Tuple[str, str]]:
+    """
+    Execute the tasks in a batch (and wait for it), then yield the (custom_id, answer) of its results.
+    If jobs were already created with the same input, their results are used instead (unless `reattach` is False).
+    Identical tasks are sent once, and with a cache, tasks already answered are not sent at all (their answers come first).
+    With OBJECTIVE_BATCH_SUBMIT_ONLY=yes, the process stops once the jobs are submitted (see run-batches.py).
+    """
+    cached = [] # (custom_id, answer) of the tasks found in the cache
+    requests = {} # custom_id -> (request key, model), of the tasks sent
+    duplicates = {} # custom_id -> custom_ids of the identical tasks not sent
+
+    def tasks_to_send() -> Iterator[dict]:
+        sent = {} # request key -> custom_id
+        for task in tasks:
+            model = task['body'].get('model') or adapter.model
+            request_key = response_key(adapter.provider, model, task['body']['messages'])
+            answer = cache.get(request_key) if cache is not None else None
+            if answer is not None or request_key in sent:
+                if metrics is not None: metrics.request(adapter.provider, model, 'batch', None, cached=True)
+            if answer is not None:
+                cached.append((task['custom_id'], answer))
+            elif request_key in sent:
+                duplicates.setdefault(sent[request_key], []).append(task['custom_id'])
+            else:
+                sent[request_key] = task['custom_id']
+                requests[task['custom_id']] = (request_key, model)
+                yield task
+
+    job = BatchJob(adapter, task_name, catalog)
+    nb_tasks = job.write(tasks_to_send())
+    if len(cached) + len(duplicates) > 0:
+        print(f'{len(cached)} tasks answered by the cache, {sum(len(ids) for ids in duplicates.values())} identical tasks not sent')
+    yield from cached
+    if nb_tasks == 0:
+        print('Nothing to execute, batch skipped')
+        for shard in job.shards: os.remove(shard.input_path)
+        return
+    if reattach: job.reattach()
+    job.submit()
+
+    if os.getenv('OBJECTIVE_BATCH_SUBMIT_ONLY') == 'yes' and not job.done():
+        print(f'Batch {task_name} submitted, its results will be collected later')
+        sys.exit(SUBMITTED_EXIT_CODE)
+
+    job.wait()
+    for custom_id, answer in job.results(metrics):
+        if cache is not None and custom_id in requests:
+            request_key, model = requests[custom_id]
+            cache.set(request_key, adapter.provider, model, answer)
+        yield custom_id, answer
+        for duplicate_id in duplicates.get(custom_id, []):
+            yield duplicate_id, answer
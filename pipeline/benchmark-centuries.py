@@ -0,0 +1,52 @@
+import argparse, time
+import pandas as pd
+import spacy
+import yaml
+import centuries
+
+# Compare the centuries read by the regex (with spaCy on the residual descriptions) to those of spaCy alone, as 23-periods did,
+# on the descriptions of the merged objects: parity (same periods by description) and speed.
+# Usage: python benchmark-centuries.py [--path ../data/objects-all.csv] [--show 20]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default='../data/objects-all.csv', help='merged objects (make merge)')
+    parser.add_argument('--show', type=int, default=20, help='number of differences printed')
+    args = parser.parse_args()
+
+    with open("./00-config.yaml", "r") as f:
+        config = yaml.safe_load(f)
+    batch_size = config['catalog']['spacy_description_batch_size']
+    nlp = spacy.load(config['catalog']['spacy_model'])
+
+    objects = pd.read_csv(args.path)
+    descriptions = list(set(description for description in objects['description'].dropna().astype(str) if 'siècle' in description))
+    print(f'{len(descriptions)} distinct descriptions with "siècle" in <{args.path}>')
+
+    # spaCy alone
+    begin_time = time.time()
+    spacy_periods = { description: centuries.from_doc(doc) for description, doc in zip(descriptions, nlp.pipe(descriptions, batch_size=batch_size)) }
+    spacy_seconds = time.time() - begin_time
+
+    # Regex, then spaCy on the residual descriptions
+    begin_time = time.time()
+    fast_periods = { description: centuries.from_text(description) for description in descriptions }
+    regex_seconds = time.time() - begin_time
+    residual = [description for description, periods in fast_periods.items() if periods is None]
+    for description, doc in zip(residual, nlp.pipe(residual, batch_size=batch_size)):
+        fast_periods[description] = centuries.from_doc(doc)
+    fast_seconds = time.time() - begin_time
+
+    # Parity: same periods (as 23-periods adds them: order and duplicates do not matter)
+    differences = [description for description in descriptions if set(spacy_periods[description]) != set(fast_periods[description])]
+    read = len(descriptions) - len(residual)
+    print(f'Regex: {read} descriptions read ({round(100 * read / len(descriptions), 1) if descriptions else 0}%), {len(residual)} left to spaCy')
+    print(f'Parity: {len(descriptions) - len(differences)} / {len(descriptions)} descriptions with the same periods')
+    for description in differences[:args.show]:
+        print(f'  spaCy {sorted(set(spacy_periods[description]))} / regex {sorted(set(fast_periods[description]))}: {description[:150]}')
+
+    # Speed
+    print(f"{'':<22}{'seconds':>10}{'desc/s':>10}")
+    for name, seconds in [('spaCy alone', spacy_seconds), ('regex', regex_seconds), ('regex + spaCy', fast_seconds)]:
+        print(f"{name:<22}{seconds:>10.2f}{len(descriptions) / seconds if seconds else 0:>10.0f}")
@@ -0,0 +1,95 @@
+import argparse, base64, json, random
+import pandas as pd
+import pymupdf
+import yaml
+import llm
+import raster
+
+# Compare image encodings on a sample of catalog pages: payload size, estimated image tokens,
+# and (with --transcribe, COST) the length of the transcription the vision model gives back.
+# Usage: python benchmark-images.py <catalog> [--pages 10] [--transcribe]
+
+presets = {
+    "default": {},
+    "grayscale": { "grayscale": True },
+    "grayscale, cropped": { "grayscale": True, "crop": True },
+    "grayscale, cropped, quality 60": { "grayscale": True, "crop": True, "jpeg_quality": 60 },
+    "grayscale, cropped, 150 dpi, 1600px": { "grayscale": True, "crop": True, "dpi": 150, "max_long_edge": 1600 },
+}
+
+
+def load_transcription_prompt(catalog_language: str) -> str:
+    """Take the prompt from the transcription notebook, so that the benchmark always uses the real one."""
+    with open("./10-transcription.ipynb", "r") as f:
+        notebook = json.load(f)
+    for cell in notebook['cells']:
+        source = ''.join(cell['source'])
+        if cell['cell_type'] == 'code' and source.startswith('# Prompt that will be sent to the LLM'):
+            variables = { 'catalog_language': catalog_language }
+            exec(source, variables)
+            return variables['prompt']
+    raise Exception('Transcription prompt not found in 10-transcription.ipynb')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('catalog')
+    parser.add_argument('--pages', type=int, default=10, help='number of sample pages')
+    parser.add_argument('--transcribe', action='store_true', help='also send the pages to the vision model (COST)')
+    args = parser.parse_args()
+
+    with open("./00-config.yaml", "r") as f:
+        config = yaml.safe_load(f)
+    llm_provider = config['model']['llm_provider']
+    model = config['model']['vision_model']
+    detail = config['rasterization']['detail']
+    folder_path = f"../catalogs/{args.catalog}"
+
+    # Sample pages (always the same ones for a given catalog)
+    doc = pymupdf.open(f"{folder_path}/catalog.pdf")
+    sample = sorted(random.Random(args.catalog).sample(range(doc.page_count), min(args.pages, doc.page_count)))
+    print(f'Benchmarking {len(presets)} encodings on pages', ', '.join(str(i + 1) for i in sample))
+
+    # Encode the pages with each preset
+    records = []
+    for preset, settings in presets.items():
+        for page_index in sample:
+            jpeg, width, height = raster.encode_page(doc[page_index], **settings)
+            records.append({
+                "preset": preset, "page": page_index + 1, "width": width, "height": height, "bytes": len(jpeg),
+                "tokens": raster.estimate_image_tokens(width, height, llm_provider, detail),
+                "b64_image": base64.b64encode(jpeg).decode()
+            })
+
+    # Transcribe them all
+    if args.transcribe:
+        prompt = load_transcription_prompt(config['catalog']['language'])
+        executor = llm.DirectExecutor(
+            llm_provider, model,
+            concurrency=config['model']['direct_concurrency'],
+            rate=config['model']['direct_rate_limits'][llm_provider],
+            retries=config['model']['direct_retries']
+        )
+        def build_requests():
+            for i, record in enumerate(records):
+                if llm_provider == "ollama":
+                    messages = [{ "role": "user", "content": prompt, "images": [record['b64_image']] }]
+                else:
+                    messages = [{ "role": "user", "content": [
+                        { "type": "text", "text": prompt },
+                        { "type": "image_url", "image_url": { "url": f"data:image/jpeg;base64,{record['b64_image']}", "detail": detail }}
+                    ]}]
+                yield i, messages
+        for answer in executor.run(build_requests()):
+            records[answer.key]['transcription_length'] = len(answer.content)
+            records[answer.key]['seconds'] = answer.seconds
+
+    # Summarize by preset
+    table = pd.DataFrame(records).drop(columns=['b64_image'])
+    table.to_csv(f"{folder_path}/benchmark-images.csv", index=False)
+    summary = table.groupby('preset', sort=False).mean(numeric_only=True).drop(columns=['page'])
+    summary['KB'] = (summary['bytes'] / 1024).round(1)
+    summary['size_vs_default'] = (summary['bytes'] / summary.loc['default', 'bytes']).round(2)
+    if args.transcribe:
+        summary['text_vs_default'] = (summary['transcription_length'] / summary.loc['default', 'transcription_length']).round(2)
+    print(summary.drop(columns=['bytes']).round(1).to_string())
@@ -0,0 +1,114 @@
+import argparse, json, os, random, shutil, subprocess, sys, tempfile, time, urllib.request
+import pymupdf
+
+# Run the round-1 and round-2 stages on synthetic catalogs against the stand-in LLM server (no cost, no Ollama),
+# and report the time of each stage, the LLM requests per second and the end-to-end time.
+# Synthetic catalogs are written in ../catalogs/_bench-NN, and removed at the end (unless --keep).
+# Usage: python benchmark-pipeline.py [--catalogs 2] [--pages 10] [--latency 0.05] [--failure-rate 0] [--rate-limit 20]
+
+round_1 = ["10-transcription.ipynb", "11-list.ipynb", "12-objects.ipynb"]
+round_2 = ["20-verify.ipynb", "21-lemmas.ipynb", "22-authors.ipynb", "23-periods.ipynb"]
+
+
+def write_catalog(path: str, nb_pages: int, seed: int) -> None:
+    """Synthetic catalog: a PDF with a few lots per page (its transcription is made up by the stand-in server anyway)."""
+    generator = random.Random(seed)
+    doc = pymupdf.open()
+    lot = 1
+    for page_index in range(nb_pages):
+        page = doc.new_page()
+        lines = [f"CATALOGUE DE BENCHMARK {seed} - PAGE {page_index + 1}", ""]
+        for _ in range(generator.randint(3, 6)):
+            lines.append(f"{lot} - Objet {generator.randint(0, 10 ** 6)}, haut. {generator.randint(5, 60)} cm.")
+            lot += 1
+        page.insert_text((72, 72), '\n'.join(lines), fontsize=11)
+    os.makedirs(path, exist_ok=True)
+    doc.save(f"{path}/catalog.pdf")
+    doc.close()
+
+
+def server_stats(server: str) -> dict:
+    with urllib.request.urlopen(f"{server}/stats") as response:
+        return json.loads(response.read())
+
+
+def wait_server(server: str, timeout: float = 10) -> None:
+    begin_time = time.time()
+    while True:
+        try: return server_stats(server)
+        except OSError:
+            if time.time() - begin_time > timeout: raise Exception(f'Stand-in server not answering on {server}')
+            time.sleep(0.1)
+
+
+def run_stage(notebook: str, catalog: str, env: dict) -> subprocess.CompletedProcess:
+    env = { **env, "OBJECTIVE_MODE": "pipeline", "OBJECTIVE_CATALOG": catalog, "OBJECTIVE_PAGE_BEGIN": "1", "OBJECTIVE_PAGE_END": "" }
+    return subprocess.run([sys.executable, "run-notebook.py", notebook], env=env, capture_output=True, text=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--catalogs', type=int, default=2, help='number of synthetic catalogs')
+    parser.add_argument('--pages', type=int, default=10, help='pages by catalog')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds for the server to answer a chat request')
+    parser.add_argument('--failure-rate', type=float, default=0, help='part of chat requests failing')
+    parser.add_argument('--rate-limit', type=float, default=None, help='chat requests per second accepted by the server')
+    parser.add_argument('--batch-latency', type=float, default=2, help='seconds for a batch to be over')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--rounds', default='1,2', help='rounds to run (1, 2 or 1,2)')
+    parser.add_argument('--keep', action='store_true', help='keep the synthetic catalogs')
+    args = parser.parse_args()
+
+    server = f"http://127.0.0.1:{args.port}"
+    notebooks = (round_1 if '1' in args.rounds.split(',') else []) + (round_2 if '2' in args.rounds.split(',') else [])
+    catalogs = [f"_bench-{i + 1:02d}" for i in range(args.catalogs)]
+    batch_folder = tempfile.mkdtemp(prefix='objective-bench-')
+    env = {
+        **os.environ, "OBJECTIVE_LLM_SERVER": server, "OBJECTIVE_BATCH_FOLDER": batch_folder,
+        "OBJECTIVE_METRICS_PATH": f"{batch_folder}/metrics.jsonl"
+    }
+
+    server_args = ["--port", str(args.port), "--latency", str(args.latency), "--failure-rate", str(args.failure_rate), "--batch-latency", str(args.batch_latency)]
+    if args.rate_limit: server_args += ["--rate-limit", str(args.rate_limit)]
+    server_process = subprocess.Popen([sys.executable, "stand-in-server.py", *server_args], stdout=subprocess.DEVNULL)
+
+    records = []
+    try:
+        wait_server(server)
+        print(f'### Create {len(catalogs)} synthetic catalogs of {args.pages} pages')
+        for i, catalog in enumerate(catalogs):
+            write_catalog(f"../catalogs/{catalog}", args.pages, seed=i)
+
+        begin_time = time.time()
+        for notebook in notebooks:
+            for catalog in catalogs:
+                stats = server_stats(server)
+                stage_begin = time.time()
+                run = run_stage(notebook, catalog, env)
+                seconds = time.time() - stage_begin
+                new_stats = server_stats(server)
+                requests = (new_stats['chat'] - stats['chat']) + (new_stats['ollama'] - stats['ollama']) + (new_stats['batch_requests'] - stats['batch_requests'])
+                records.append({ "stage": notebook, "catalog": catalog, "seconds": seconds, "requests": requests, "ok": run.returncode == 0 })
+                print(f'{notebook} [{catalog}]: {seconds:.1f}s, {requests} LLM requests' + ('' if run.returncode == 0 else ' FAILED'))
+                if run.returncode != 0: print(run.stdout[-2000:], run.stderr[-2000:], sep='\n')
+        total_seconds = time.time() - begin_time
+        final_stats = server_stats(server)
+    finally:
+        server_process.terminate()
+        server_process.wait()
+        shutil.rmtree(batch_folder, ignore_errors=True)
+        if not args.keep:
+            for catalog in catalogs: shutil.rmtree(f"../catalogs/{catalog}", ignore_errors=True)
+
+    # Report by stage
+    print('\n### Report')
+    print(f"{'stage':<24}{'seconds':>10}{'requests':>10}{'req/s':>10}")
+    for notebook in notebooks:
+        stage_records = [record for record in records if record['stage'] == notebook]
+        seconds, requests = sum(record['seconds'] for record in stage_records), sum(record['requests'] for record in stage_records)
+        failed = len([record for record in stage_records if not record['ok']])
+        print(f"{notebook:<24}{seconds:>10.1f}{requests:>10}{requests / seconds if seconds else 0:>10.1f}" + (f'  ({failed} failed)' if failed else ''))
+    nb_requests = sum(record['requests'] for record in records)
+    print(f'End-to-end: {total_seconds:.1f}s for {len(catalogs)} catalogs, {nb_requests} LLM requests ({nb_requests / total_seconds:.1f} req/s)')
+    print(f"Server errors sent: {final_stats['errors_429']} rate limits, {final_stats['errors_500']} failures")
+    if any(not record['ok'] for record in records): sys.exit(1)
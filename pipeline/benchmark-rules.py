@@ -0,0 +1,36 @@
+import argparse, time
+import pandas as pd
+from rules import Rules
+
+# Apply the keyword rules of 03-rules.yaml (periods and corrections steps) to the merged objects, and report rows per second.
+# Nothing is saved.
+# Usage: python benchmark-rules.py [--path ../data/objects-all.csv] [--repeat 3]
+
+fields = ['object_type', 'material_technique', 'origin', 'period', 'author']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default='../data/objects-all.csv', help='merged objects (make merge)')
+    parser.add_argument('--rules', default='./03-rules.yaml')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each rule set, the fastest one is reported')
+    args = parser.parse_args()
+
+    objects = pd.read_csv(args.path)
+    descriptions = list(objects['description'].fillna('').astype(str).str.lower())
+    lines = [dict(zip(fields, line)) for line in objects[fields].fillna('').astype(str).apply(lambda column: column.str.lower()).itertuples(index=False)]
+    print(f'{len(objects)} rows in <{args.path}>')
+
+    print(f"{'rules':<14}{'count':>7}{'words':>7}{'compile ms':>12}{'seconds':>10}{'rows/s':>10}{'changed':>9}")
+    for section, section_fields in [('periods', ['origin', 'period']), ('corrections', fields)]:
+        begin_time = time.time()
+        rules = Rules.load(args.rules, section)
+        compile_seconds = time.time() - begin_time
+        best_seconds = None
+        for _ in range(args.repeat):
+            begin_time = time.time()
+            results = [rules.apply(description, { field: line[field] for field in section_fields }) for description, line in zip(descriptions, lines)]
+            seconds = time.time() - begin_time
+            best_seconds = seconds if best_seconds is None else min(best_seconds, seconds)
+        changed = len([1 for result, line in zip(results, lines) if any(result[field] != line[field] for field in section_fields)])
+        print(f"{section:<14}{len(rules.rules):>7}{len(rules.words):>7}{compile_seconds * 1000:>12.0f}{best_seconds:>10.2f}{len(lines) / best_seconds if best_seconds else 0:>10.0f}{changed:>9}")
@@ -0,0 +1,245 @@
+import hashlib, json, os, re, sqlite3, threading, time, unicodedata
+
+
+cache_folder = "../cache"
+
+
+class TranscriptionCache:
+    """
+    On-disk cache of page transcriptions.
+    Entries are addressed by the hash of the rendered page image, the vision model and the prompt:
+    any change to one of them is a miss, everything else is reused across runs and catalogs.
+    """
+
+    def __init__(self, folder: str = f"{cache_folder}/transcriptions") -> None:
+        self.folder = folder
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.folder, exist_ok=True)
+
+    def key(self, b64_image: str, model: str, prompt: str) -> str:
+        """Content address of a page transcription."""
+        hasher = hashlib.sha256()
+        for part in [model, prompt, b64_image]:
+            hasher.update(part.encode())
+            hasher.update(b"\0")
+        return hasher.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, key[:2], f"{key}.txt")
+
+    def get(self, key: str) -> str | None:
+        """Return the cached transcription, or None (and count a hit or a miss)."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        self.hits += 1
+        with open(path, "r", encoding="utf-8") as file:
+            return file.read()
+
+    def set(self, key: str, transcription: str) -> None:
+        """Save a transcription. Written aside then renamed, so that a crash never leaves a partial entry."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write(transcription)
+        os.replace(tmp_path, path)
+
+    def report(self) -> None:
+        total = self.hits + self.misses
+        rate = f"{round(100 * self.hits / total, 1)}%" if total else "-"
+        print(f"Transcription cache: {self.hits} hits, {self.misses} misses (hit rate: {rate})")
+
+
+def normalize_messages(messages: list) -> str:
+    """Canonical text of chat messages: key order and spaces at the end of lines and texts do not matter."""
+    def normalize(value):
+        if isinstance(value, str): return '\n'.join(line.rstrip() for line in value.strip().split('\n'))
+        if isinstance(value, list): return [normalize(item) for item in value]
+        if isinstance(value, dict): return { key: normalize(item) for key, item in value.items() }
+        return value
+    return json.dumps(normalize(messages), ensure_ascii=False, sort_keys=True)
+
+
+def response_key(provider: str, model: str, messages: list) -> str:
+    """Content address of an LLM request."""
+    hasher = hashlib.sha256()
+    for part in [provider, model, normalize_messages(messages)]:
+        hasher.update(part.encode())
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk cache of LLM answers, shared by all stages and catalogs (a SQLite database, safe across threads and processes).
+    Entries are addressed by the provider, the model and the normalized messages: a rerun after a small edit only sends
+    the requests that changed. Entries older than `ttl` seconds are misses (None: no limit), and the least recently used
+    entries are removed once the answers weigh more than `max_bytes` (None: no limit).
+    """
+
+    # Eviction is checked every this number of writes
+    EVICTION_PERIOD = 500
+
+    def __init__(self, path: str = f"{cache_folder}/responses.sqlite", ttl: float | None = None, max_bytes: int | None = None) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, provider TEXT, model TEXT, content TEXT, size INTEGER, created REAL, used REAL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+
+    def key(self, provider: str, model: str, messages: list) -> str:
+        return response_key(provider, model, messages)
+
+    def get(self, key: str) -> str | None:
+        """Return the cached answer, or None (and count a hit or a miss)."""
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT content, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return row[0]
+
+    def set(self, key: str, provider: str, model: str, content: str) -> None:
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, provider, model, content, size, created, used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, provider, model, content, len(content.encode()), now, now)
+            )
+            self.writes += 1
+        if self.writes % self.EVICTION_PERIOD == 0: self.evict()
+
+    def delete(self, key: str) -> None:
+        """Forget an answer (for instance an invalid one, to ask it again)."""
+        with self.lock:
+            self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def evict(self) -> int:
+        """Remove the expired entries, then the least recently used ones beyond the size limit, and return their number."""
+        removed = 0
+        with self.lock:
+            if self.ttl is not None:
+                removed += self.connection.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,)).rowcount
+            if self.max_bytes is not None:
+                excess = (self.connection.execute("SELECT SUM(size) FROM responses").fetchone()[0] or 0) - self.max_bytes
+                if excess > 0:
+                    keys = []
+                    for key, size in self.connection.execute("SELECT key, size FROM responses ORDER BY used"):
+                        if excess <= 0: break
+                        keys.append((key,))
+                        excess -= size
+                    self.connection.executemany("DELETE FROM responses WHERE key = ?", keys)
+                    removed += len(keys)
+        return removed
+
+    def close(self) -> None:
+        self.evict()
+        self.connection.close()
+
+    def report(self) -> None:
+        total = self.hits + self.misses
+        rate = f"{round(100 * self.hits / total, 1)}%" if total else "-"
+        print(f"Response cache: {self.hits} hits, {self.misses} misses (hit rate: {rate})")
+
+
+def open_response_cache(model_config: dict) -> ResponseCache | None:
+    """Response cache set in the `model` part of 00-config.yaml (None if disabled)."""
+    if not model_config.get('response_cache'): return None
+    ttl_days, max_mb = model_config.get('response_cache_ttl_days'), model_config.get('response_cache_max_mb')
+    return ResponseCache(
+        ttl=ttl_days * 24 * 3600 if ttl_days is not None else None,
+        max_bytes=int(max_mb * 1024 * 1024) if max_mb is not None else None
+    )
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form of a value or a description: case, accents composition and spaces do not matter."""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text).lower()).strip()
+
+
+class VerdictMemo:
+    """
+    Verdicts of the local model on the values (20-verify) and supposed authors (22-authors) of descriptions, kept across runs and catalogs (SQLite database).
+    Entries are addressed by the field, the normalized value and the hash of the normalized description.
+    With `prior_confirmations`, a value already confirmed in that many different descriptions is accepted without asking
+    (counts are taken when the memo is opened, so that a run does not depend on the order of its answers).
+    """
+
+    def __init__(self, path: str = f"{cache_folder}/verdicts.sqlite", prior_confirmations: int | None = None) -> None:
+        self.path = path
+        self.prior_confirmations = prior_confirmations
+        self.hits = 0
+        self.prior_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS verdicts "
+                "(field TEXT, value TEXT, description_hash TEXT, verdict INTEGER, model TEXT, date TEXT, PRIMARY KEY (field, value, description_hash))"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS verdicts_value ON verdicts (value)")
+            self.confirmations = {
+                (field, value): count for field, value, count
+                in self.connection.execute("SELECT field, value, COUNT(*) FROM verdicts WHERE verdict = 1 GROUP BY field, value")
+            }
+
+    @staticmethod
+    def key(field: str, value: str, description: str) -> tuple:
+        return field, normalize_text(value), hashlib.sha256(normalize_text(description).encode()).hexdigest()
+
+    def get(self, field: str, value: str, description: str) -> bool | None:
+        """Known verdict (from the same value and description, or from the prior of the value), or None (and count it)."""
+        key = self.key(field, value, description)
+        with self.lock:
+            row = self.connection.execute("SELECT verdict FROM verdicts WHERE field = ? AND value = ? AND description_hash = ?", key).fetchone()
+            if row is not None:
+                self.hits += 1
+                return bool(row[0])
+            if self.prior_confirmations and self.confirmations.get(key[:2], 0) >= self.prior_confirmations:
+                self.prior_hits += 1
+                return True
+            self.misses += 1
+        return None
+
+    def record(self, field: str, value: str, description: str, verdict: bool, model: str) -> None:
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO verdicts (field, value, description_hash, verdict, model, date) VALUES (?, ?, ?, ?, ?, ?)",
+                (*self.key(field, value, description), int(verdict), model, time.strftime('%Y-%m-%dT%H:%M:%S'))
+            )
+
+    def forget(self, value: str, field: str | None = None) -> int:
+        """Remove the verdicts of a value (of all fields, or of the given one), and return their number."""
+        query, parameters = "DELETE FROM verdicts WHERE value = ?", [normalize_text(value)]
+        if field is not None: query, parameters = query + " AND field = ?", parameters + [field]
+        with self.lock:
+            return self.connection.execute(query, parameters).rowcount
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def report(self) -> None:
+        total = self.hits + self.prior_hits + self.misses
+        rate = f"{round(100 * (self.hits + self.prior_hits) / total, 1)}%" if total else "-"
+        print(f"Verdict memo: {self.hits} known verdicts, {self.prior_hits} values accepted by prior, {self.misses} to ask (hit rate: {rate})")
@@ -0,0 +1,87 @@
+import re
+from typing import List
+
+# Centuries of the descriptions (23-periods): the words read as adjectives of "siècle", normalized by get_period.
+# The regex reads the usual forms ("XVIIIe siècle", "18ème siècle", "dix-huitième siècle") without parsing the description,
+# spaCy only parses the descriptions it cannot read for sure (see from_text).
+
+periods_blacklist_chars = ['°', 'ᵉ', 'e', '⁰', '^']
+correspondance = {
+    'xvir': 'xvi',
+    'xviir': 'xvii',
+    'xvièm': 'xvi',
+    'xviièm': 'xvii',
+    '13': 'xiii',
+    '14': 'xiv',
+    '15': 'xv',
+    '16': 'xvi',
+    '17': 'xvii',
+    '18': 'xviii',
+    '19': 'xix',
+    'troisièm': 'iii',
+    'sizièm': 'vi',
+    'sixièm': 'vi',
+    'dixièm': 'x',
+    'onzièm': 'xi',
+    'douzièm': 'xii',
+    'trizièm': 'xiii',
+    'quatorzièm': 'xiv',
+    'quinzièm': 'xv',
+    'dix-sptièm': 'xvii',
+    'dix-huitièm': 'xvii',
+    'drnir': 'xviii'
+}
+
+
+def get_period(period: str) -> str:
+    text = period.lower()
+    for bl in periods_blacklist_chars:
+        text = text.replace(bl, '')
+    if text in correspondance:
+        text = correspondance[text]
+    return text
+
+
+# Roman numerals and digits with an ordinal suffix (e, ème, è, superscripts), and ordinal words
+century_word = (
+    r"(?:(?=[xvi])x{0,3}(?:ix|iv|v?i{0,3})|\d{1,2})(?:e|ème|eme|è|ᵉ|°)"
+    r"|[a-zàâçéèêëîïôûù-]*ième"
+)
+century_regex = re.compile(rf"(?<![\w'’^-])({century_word})(?![\w^-])", re.IGNORECASE)
+
+# Words around "siècle" which cannot be one of its adjectives (anything else is left to spaCy)
+safe_before = ['du', 'de', 'le', 'au', 'ce', 'un', 'chaque', 'même', 'd’', "d'", "l'", 'l’']
+safe_after = ['de', 'du', 'des', 'et', 'ou', 'en', 'à', 'au', 'aux', 'avec', 'sur', 'par', 'pour', 'dans', 'environ']
+siecle_regex = re.compile(r"(?<![\w-])siècle(?![\w-])")
+word_before_regex = re.compile(r"([\w'’^°ᵉ⁰-]+)\s+$")
+word_after_regex = re.compile(r"^\s*([\w'’-]*)")
+
+
+def from_text(description: str) -> List[str] | None:
+    """
+    Periods of the centuries of a description read by the regex, or None when spaCy is needed:
+    a century word not right before "siècle", or "siècle" next to a word which could be one of its adjectives.
+    """
+    periods = []
+    centuries_read = set()
+    for match in siecle_regex.finditer(description):
+        before = word_before_regex.search(description[:match.start()])
+        after = word_after_regex.match(description[match.end():]).group(1)
+        if after != '' and after.lower() not in safe_after: return None
+        if before is None: continue
+        century = century_regex.fullmatch(before.group(1))
+        if century is not None:
+            periods.append(get_period(before.group(1)))
+            centuries_read.add(before.start(1))
+        elif before.group(1).lower() not in safe_before:
+            return None
+
+    # Other century words ("XVIIe et XVIIIe siècle") depend on how spaCy links them
+    if any(century.start(1) not in centuries_read for century in century_regex.finditer(description)): return None
+    return [period for period in periods if period != '']
+
+
+def from_doc(doc) -> List[str]:
+    """Periods of the centuries of a parsed description: adjectives whose head is "siècle"."""
+    periods_raw = [get_period(token.text) for token in doc if token.head.text == 'siècle' and token.pos_ == 'ADJ']
+    return [p for p in periods_raw if p != '']
@@ -0,0 +1,76 @@
+import hashlib, os, sys, time
+import pandas as pd
+import spacy
+from spacy.tokens import DocBin
+import yaml
+
+
+class DocStore:
+    """
+    spaCy parses of the lot descriptions of a catalog, shared by the round-2 stages (22-authors, 23-periods).
+    Each distinct description is parsed once with nlp.pipe, and kept on disk as a DocBin (`descriptions.spacy` in the catalog folder),
+    addressed by the hash of the model and the description: reruns only parse new or changed descriptions.
+    The model is only loaded when there is something to parse, docs are otherwise read with the vocabulary of a blank pipeline.
+    """
+
+    def __init__(self, folder_path: str, model: str, batch_size: int = 32) -> None:
+        self.path = f"{folder_path}/descriptions.spacy"
+        self.model = model
+        self.batch_size = batch_size
+        self.nlp = None
+        self.vocab = spacy.blank(model.split('_')[0]).vocab
+        self.parsed = 0
+        self.docs = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as file:
+                for doc in DocBin(store_user_data=True).from_bytes(file.read()).get_docs(self.vocab):
+                    self.docs[doc.user_data['key']] = doc
+
+    def key(self, description: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{description}".encode()).hexdigest()
+
+    def parse(self, descriptions, keep_others: bool = True) -> dict:
+        """
+        Return the doc of each description (description -> Doc), parsing the missing ones and saving them.
+        Without `keep_others`, docs of descriptions not asked for are removed from the store (when all descriptions are asked for).
+        """
+        descriptions = list(dict.fromkeys(descriptions))
+        keys = { description: self.key(description) for description in descriptions }
+        missing = [description for description in descriptions if keys[description] not in self.docs]
+        if len(missing) > 0:
+            if self.nlp is None: self.nlp = spacy.load(self.model)
+            begin_time = time.time()
+            for description, doc in zip(missing, self.nlp.pipe(missing, batch_size=self.batch_size)):
+                doc.user_data = { 'key': keys[description] } # Only the key is kept (not the transformer data)
+                self.docs[keys[description]] = doc
+            self.parsed += len(missing)
+            print(f'{len(missing)} descriptions parsed in {round(time.time() - begin_time, 1)}s')
+        if not keep_others:
+            self.docs = { key: self.docs[key] for key in keys.values() }
+        if len(missing) > 0 or not keep_others:
+            self.save()
+        return { description: self.docs[keys[description]] for description in descriptions }
+
+    def save(self) -> None:
+        """Written aside then renamed, so that a crash never leaves a partial store."""
+        doc_bin = DocBin(store_user_data=True, docs=self.docs.values())
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            file.write(doc_bin.to_bytes())
+        os.replace(tmp_path, self.path)
+
+    def report(self) -> None:
+        print(f"Doc store: {len(self.docs)} docs, {self.parsed} descriptions parsed by this run")
+
+
+# Parse the descriptions of a catalog ahead of the stages that use them (`make parse`)
+# Usage: python docstore.py <catalog>
+if __name__ == '__main__':
+    with open("./00-config.yaml", "r") as f:
+        config = yaml.safe_load(f)
+    catalog = sys.argv[1] if len(sys.argv) > 1 else config['catalog']['folder_name']
+    folder_path = f"../catalogs/{catalog}"
+    objects = pd.read_csv(f'{folder_path}/objects.csv')
+    store = DocStore(folder_path, config['catalog']['spacy_model'], config['catalog']['spacy_description_batch_size'])
+    store.parse(objects['description'].dropna().astype(str), keep_others=False)
+    store.report()
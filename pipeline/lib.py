@@ -1,153 +1,7 @@
 import datetime, json, time, os, pandas as pd, requests
-from mistralai import Mistral
-from openai import OpenAI
 from typing import List
 
 
-def mistralai_batch_execution(
-        tasks: dict,
-        client: Mistral, model: str, file_name: str, task_name: str
-    ) -> list:
-
-    # Local saving of batch files (for checking)
-    if not os.path.exists('../batch_files'): os.mkdir('../batch_files')
-    now_str = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M")
-    input_path = f"../batch_files/{task_name}_input_{now_str}.jsonl"
-    output_path = f"../batch_files/{task_name}_output_{now_str}.jsonl"
-    error_path = f"../batch_files/{task_name}_error_{now_str}.jsonl"
-
-    print('Creating the batch file...')
-    with open(input_path, "w") as f:
-        for entry in tasks:
-            f.write(json.dumps(entry) + "\n")
-
-    print('Uploading the batch file...')
-    file_infos = client.files.upload(file={"file_name": f"{file_name}.jsonl", "content": open(input_path, 'rb') }, purpose="batch")
-
-    print('Creating the batch job...')
-    batch_job = client.batch.jobs.create(
-        input_files=[file_infos.id],
-        model=model,
-        endpoint="/v1/chat/completions",
-        metadata={"task": task_name}
-    )
-
-    # Wait for the batch to proceed
-    while batch_job.status in ["QUEUED", "RUNNING"]:
-        batch_job = client.batch.jobs.get(job_id=batch_job.id)
-        nb_fail = batch_job.failed_requests
-        nb_succ = batch_job.succeeded_requests
-        advan = round((nb_fail + nb_succ) / batch_job.total_requests, 4) * 100            
-        infos = f'> Status: {batch_job.status} - Failed: {nb_fail} - Successful: {nb_succ} - Advancement: {round(advan)}%                  '
-        print(infos, end="\r")
-        time.sleep(2)
-    print(f"Batch job {batch_job.id} completed with status: {batch_job.status}")
-
-    # Error file
-    print('Downloading result error file...')
-    if batch_job.error_file is not None:
-        error_file = client.files.download(file_id=batch_job.error_file)
-        file = open(error_path, 'w')
-        for chunk in error_file.stream:
-            file.write(chunk.decode("utf-8", errors="replace"))
-        file.close()
-        raise Exception(f'There was an error in executing batch, see error file <{error_path}> for more information.')
-
-    # Output
-    print('Downloading result output file...')
-    if batch_job.output_file is not None:
-        output_file = client.files.download(file_id=batch_job.output_file)
-        file = open(output_path, 'w')
-        for chunk in output_file.stream:
-            file.write(chunk.decode("utf-8", errors="replace"))
-        file.close()
-
-    # Read the output file 
-    results = []
-    file = open(output_path, 'r')
-    for line in file.readlines():
-        results.append(json.loads(line.strip()))
-    file.close()
-
-    # Sort results by given ids
-    results = sorted(results, key=lambda x: x['custom_id'])
-
-    # Get answers out of object
-    answers = []
-    for result in results:
-        answers.append(result['response']['body']['choices'][0]['message']['content'])
-        
-    return answers
-
-
-def openai_batch_execution(
-        tasks: dict,
-        client: OpenAI, endpoint: str, task_name: str,
-    ) -> list:
-
-    # Local saving of batch files (for checking)
-    if not os.path.exists('../batch_files'): os.mkdir('../batch_files')
-    now_str = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M")
-    input_path = f"../batch_files/{task_name}_input_{now_str}.jsonl"
-    output_path = f"../batch_files/{task_name}_output_{now_str}.jsonl"
-    error_path = f"../batch_files/{task_name}_error_{now_str}.jsonl"
-    
-    print('Creating the batch file...')
-    with open(input_path, "w") as f:
-        for entry in tasks:
-            f.write(json.dumps(entry) + "\n")
-
-    print('Uploading the batch file...')
-    file_infos = client.files.create(file=open(input_path, 'rb'), purpose='batch')
-
-    print('Creating the batch job...')
-    batch_job = client.batches.create(
-        input_file_id=file_infos.id,
-        completion_window="24h",
-        endpoint=endpoint,
-        metadata={"job_type": task_name}
-    )
-
-    while batch_job.status in ["validating", "in_progress", "finalizing", "cancelling"]:
-        batch_job = client.batches.retrieve(job_id=batch_job.id)
-        nb_fail = batch_job.request_counts.failed
-        nb_succ = batch_job.request_counts.completed
-        advan = round((nb_fail + nb_succ) / batch_job.request_counts.total, 4) * 100   
-        infos = f'> Status: {batch_job.status} - Failed: {nb_fail} - Successful: {nb_succ} - Advancement: {advan}%                  '
-        print(infos, end="\r")
-        time.sleep(2)
-
-    if batch_job.error_file_id:
-        print('Downloading error file...')
-        output = client.files.content(batch_job.error_file_id)
-        file = open(error_path, 'w')
-        file.write(output.text)
-        file.close()
-
-    if batch_job.output_file_id:
-        print('Downloading output file...')
-        output = client.files.content(batch_job.output_file_id)
-        file = open(output_path, 'w')
-        file.write(output.text)
-        file.close()
-
-    # Build objects
-    lines = output.text.split('\n')
-    results = []
-    for line in lines:
-        results.append(json.loads(line))
-
-    # Sort results by given ids
-    results = sorted(results, key=lambda x: x['custom_id'])
-
-    # Get answers out of object
-    answers = []
-    for result in results:
-        answers.append(result['response']['body']['choices'][0]['message']['content'])
-        
-    return answers
-
-
 def percent(nb: float) -> str:
     """Format the number sent into a % number, eg 0.012 into "01.2%" """
     the_number = round(100 * nb, 2)
@@ -0,0 +1,376 @@
+import asyncio, contextlib, math, os, queue, random, threading, time
+from typing import Any, Iterable, Iterator, List, NamedTuple, Tuple
+import httpx
+from cache import ResponseCache, response_key
+from metrics import Metrics
+
+
+class Answer(NamedTuple):
+    """Answer of the LLM to one request of the direct executor."""
+    key: Any
+    content: str
+    seconds: float
+    cached: bool = False # Not sent: answer from the cache, or from an identical request of the same run
+
+
+class RequestFailed(Exception):
+    """A request of the direct executor failed (after its retries): the original error is the cause."""
+
+    def __init__(self, key: Any, seconds: float, error: BaseException) -> None:
+        super().__init__(f"Request {key} failed: {type(error).__name__}: {error}")
+        self.key = key
+        self.seconds = seconds
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough number of tokens of a text (about 4 characters by token for latin languages), without calling a tokenizer."""
+    return math.ceil(len(text) / 4)
+
+
+def provider_usage(response, provider: str) -> Tuple[int, int] | None:
+    """(input tokens, output tokens) of a chat response, as given by the provider (None if not given)."""
+    try:
+        if provider == "ollama": return response['prompt_eval_count'], response['eval_count']
+        return response.usage.prompt_tokens, response.usage.completion_tokens
+    except (AttributeError, KeyError, TypeError):
+        return None
+
+
+def count_tokens(messages: List[dict], content: str | None, usage: Tuple[int, int] | None) -> Tuple[int, int, bool]:
+    """(input tokens, output tokens, estimated) of a request: the usage given by the provider, or an estimation (text only)."""
+    if usage is not None and None not in usage: return usage[0], usage[1], False
+    text = ''
+    for message in messages:
+        parts = message.get('content', '')
+        text += parts if isinstance(parts, str) else ''.join(part.get('text', '') for part in parts if isinstance(part, dict))
+    return estimate_tokens(text), estimate_tokens(content or ''), True
+
+
+def _client_settings(provider: str, server: str | None) -> dict:
+    """Client arguments of a provider: API key, and address if a stand-in server is used (see stand-in-server.py)."""
+    if provider == "openai":
+        settings = { "api_key": os.getenv("OPENAI_API_KEY_OBJECTIVE") }
+        if server: settings = { "api_key": settings['api_key'] or "stand-in", "base_url": f"{server}/v1" }
+        return settings
+    if provider == "mistralai":
+        settings = { "api_key": os.getenv("MISTRALAI_API_KEY_OBJECTIVE") }
+        if server: settings = { "api_key": settings['api_key'] or "stand-in", "server_url": server }
+        return settings
+    if provider == "ollama":
+        return { "host": server } if server else {}
+    raise Exception(f'Unknown LLM provider: {provider}')
+
+
+def client(provider: str, server: str | None = None):
+    """Create the client of the given LLM provider (openai / mistralai / ollama), on the given server if set."""
+    if provider == "openai":
+        from openai import OpenAI
+        return OpenAI(**_client_settings(provider, server))
+    if provider == "mistralai":
+        from mistralai import Mistral
+        return Mistral(**_client_settings(provider, server))
+    if provider == "ollama":
+        import ollama
+        return ollama.Client(**_client_settings(provider, server))
+    raise Exception(f'Unknown LLM provider: {provider}')
+
+
+def async_client(provider: str, server: str | None = None):
+    """Create the asynchronous client of the given LLM provider (openai / mistralai / ollama), on the given server if set."""
+    if provider == "openai":
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(**_client_settings(provider, server), max_retries=0)
+    if provider == "mistralai":
+        from mistralai import Mistral
+        return Mistral(**_client_settings(provider, server))
+    if provider == "ollama":
+        import ollama
+        return ollama.AsyncClient(**_client_settings(provider, server))
+    raise Exception(f'Unknown LLM provider: {provider}')
+
+
+def _format_settings(provider: str, json_format: bool) -> dict:
+    """Chat arguments asking for an answer in JSON (none for plain text)."""
+    if not json_format: return {}
+    if provider == "ollama": return { "format": "json" }
+    return { "response_format": { "type": "json_object" } }
+
+
+def chat(
+        client, provider: str, model: str, messages: List[dict], cache: ResponseCache | None = None, metrics: Metrics | None = None,
+        json_format: bool = False
+    ) -> Answer:
+    """Send a chat request to the given provider and return its answer, from the cache if the same request was already sent."""
+    key = response_key(provider, model, messages)
+    if cache is not None:
+        content = cache.get(key)
+        if content is not None:
+            if metrics is not None: metrics.request(provider, model, 'direct', 0, cached=True)
+            return Answer(key, content, 0, cached=True)
+
+    begin_time = time.time()
+    try:
+        if provider == "openai":
+            response = client.chat.completions.create(model=model, messages=messages, **_format_settings(provider, json_format))
+            content = response.choices[0].message.content
+        elif provider == "mistralai":
+            response = client.chat.complete(model=model, messages=messages, **_format_settings(provider, json_format))
+            content = response.choices[0].message.content
+        elif provider == "ollama":
+            response = client.chat(model=model, messages=messages, **_format_settings(provider, json_format))
+            content = response['message']['content']
+        else:
+            raise Exception(f'Unknown LLM provider: {provider}')
+    except Exception:
+        if metrics is not None: metrics.request(provider, model, 'direct', time.time() - begin_time, failed=True)
+        raise
+    seconds = time.time() - begin_time
+    if metrics is not None: metrics.request(provider, model, 'direct', seconds, *count_tokens(messages, content, provider_usage(response, provider)))
+    if cache is not None: cache.set(key, provider, model, content)
+    return Answer(key, content, seconds)
+
+
+async def async_chat(
+        client, provider: str, model: str, messages: List[dict], json_format: bool = False
+    ) -> Tuple[str, Tuple[int, int] | None]:
+    """Send a chat request to the given provider and return the answer text, with the token usage if given."""
+    if provider == "openai":
+        response = await client.chat.completions.create(model=model, messages=messages, **_format_settings(provider, json_format))
+        return response.choices[0].message.content, provider_usage(response, provider)
+    if provider == "mistralai":
+        response = await client.chat.complete_async(model=model, messages=messages, **_format_settings(provider, json_format))
+        return response.choices[0].message.content, provider_usage(response, provider)
+    if provider == "ollama":
+        response = await client.chat(model=model, messages=messages, **_format_settings(provider, json_format))
+        return response['message']['content'], provider_usage(response, provider)
+    raise Exception(f'Unknown LLM provider: {provider}')
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Rate limit (429), server errors (5xx) and network errors are worth a retry, whatever the provider."""
+    status = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError, asyncio.TimeoutError))
+
+
+class TokenBucket:
+    """Rate limiter: allows `rate` requests per second on average, with bursts up to `capacity` requests."""
+
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AdaptiveThrottle:
+    """
+    Concurrency limit driven by the observed latency, for local models (instead of a fixed cooldown between requests).
+    While answers come within `tolerance` times the fastest latency seen, one more request is allowed in flight
+    (up to `max_concurrency`, eg the parallel slots of Ollama). Once they get slower (busy or overheating computer),
+    the limit is cut by a quarter, and at a single request, a pause as long as the extra latency is made before the next one.
+    """
+
+    def __init__(self, max_concurrency: int, tolerance: float = 3) -> None:
+        self.max_concurrency = max_concurrency
+        self.tolerance = tolerance
+        self.limit = 1.0
+        self.pause = 0.0
+        self.fastest = None
+
+    def bind(self) -> None:
+        """Prepare the throttle for a new event loop (what was learnt about latency is kept)."""
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+
+    def observe(self, seconds: float) -> None:
+        self.fastest = seconds if self.fastest is None else min(self.fastest, seconds)
+        excess = seconds - self.tolerance * self.fastest
+        if excess <= 0:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.pause = 0
+        elif self.limit > 1:
+            self.limit = max(1, self.limit * 0.75)
+        else:
+            self.pause = excess
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Wait for a free slot, and learn from the latency of the request made in it."""
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        if self.pause > 0: await asyncio.sleep(self.pause)
+        begin_time = time.time()
+        succeeded = False
+        try:
+            yield
+            succeeded = True
+        finally:
+            async with self.condition:
+                self.in_flight -= 1
+                if succeeded: self.observe(time.time() - begin_time)
+                self.condition.notify_all()
+
+
+_DONE = object()
+
+
+class DirectExecutor:
+    """
+    Send chat requests to the LLM provider concurrently, in direct mode.
+    At most `concurrency` requests are in flight, at most `rate` requests are started per second (None: no limit),
+    and rate limit / server errors are retried with exponential backoff. With a throttle, the number of requests in flight
+    follows the latency instead (see AdaptiveThrottle). Identical requests of a run are sent once, and with a cache, requests already answered are not sent at all.
+    Answers are given back in the order of the requests, as soon as they (and all previous ones) are there.
+    """
+
+    def __init__(
+            self, provider: str, model: str,
+            concurrency: int = 8, rate: float | None = None, retries: int = 5, backoff: float = 1, max_backoff: float = 60,
+            server: str | None = None, cache: ResponseCache | None = None, metrics: Metrics | None = None,
+            json_format: bool = False, throttle: AdaptiveThrottle | None = None
+        ) -> None:
+        self.provider = provider
+        self.model = model
+        self.server = server
+        self.cache = cache
+        self.metrics = metrics
+        self.json_format = json_format
+        self.throttle = throttle
+        self.concurrency = concurrency
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def _record(self, seconds: float, **infos) -> None:
+        if self.metrics is not None: self.metrics.request(self.provider, self.model, 'direct', seconds, **infos)
+
+    async def _request(self, client, messages: List[dict]) -> str:
+        for attempt in range(self.retries + 1):
+            if self.bucket is not None:
+                await self.bucket.acquire()
+            begin_time = None
+            try:
+                # Latency of the model only: the time waiting for a slot is not counted
+                async with (self.throttle.slot() if self.throttle is not None else self.semaphore):
+                    begin_time = time.time()
+                    content, usage = await async_chat(client, self.provider, self.model, messages, self.json_format)
+                input_tokens, output_tokens, estimated = count_tokens(messages, content, usage)
+                self._record(time.time() - begin_time, input_tokens=input_tokens, output_tokens=output_tokens, estimated=estimated, retries=attempt)
+                return content
+            except Exception as error:
+                if attempt == self.retries or not is_retryable(error):
+                    self._record(time.time() - begin_time if begin_time is not None else 0, retries=attempt, failed=True)
+                    raise error
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1)
+                print(f'[LLM] {type(error).__name__}, retrying in {round(delay, 1)}s ({attempt + 1} of {self.retries})')
+                await asyncio.sleep(delay)
+
+    async def _shared_request(self, client, messages: List[dict]) -> Tuple[str, bool]:
+        """Answer of the request and whether it comes from the cache: identical requests wait for the first one."""
+        request_key = response_key(self.provider, self.model, messages)
+        if self.cache is not None:
+            content = self.cache.get(request_key)
+            if content is not None:
+                self._record(0, cached=True)
+                return content, True
+        if request_key in self.requests:
+            content = await asyncio.shield(self.requests[request_key])
+            self._record(0, cached=True)
+            return content, True
+        self.requests[request_key] = asyncio.ensure_future(self._request(client, messages))
+        content = await asyncio.shield(self.requests[request_key])
+        if self.cache is not None: self.cache.set(request_key, self.provider, self.model, content)
+        return content, False
+
+    async def _answer(self, client, position: int, key: Any, messages: List[dict], results: queue.Queue) -> None:
+        begin_time = time.time()
+        try:
+            content, cached = await self._shared_request(client, messages)
+            results.put((position, Answer(key, content, time.time() - begin_time, cached)))
+        except Exception as error:
+            failure = RequestFailed(key, time.time() - begin_time, error)
+            failure.__cause__ = error
+            results.put((position, failure))
+
+    async def _main(self, requests: Iterable, results: queue.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        if self.throttle is not None: self.throttle.bind()
+        self.window = asyncio.Semaphore(4 * self.concurrency) # Answers waiting to be given back, at most
+        self.bucket = TokenBucket(self.rate) if self.rate else None
+        self.requests = {} # request key -> answer being asked (shared by identical requests)
+        client = async_client(self.provider, self.server)
+
+        # Requests are pulled lazily (in a thread, they can be expensive to build)
+        iterator = iter(requests)
+        tasks = []
+        try:
+            while True:
+                await self.window.acquire()
+                request = await loop.run_in_executor(None, next, iterator, _DONE)
+                if request is _DONE: break
+                key, messages = request
+                tasks.append(asyncio.create_task(self._answer(client, len(tasks), key, messages, results)))
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            for task in tasks + list(self.requests.values()): task.cancel()
+            raise
+        results.put((len(tasks), _DONE))
+
+    def run(self, requests: Iterable) -> Iterator[Answer]:
+        """Execute the (key, messages) requests, and yield their answers in the same order."""
+
+        results = queue.Queue()
+        loop = asyncio.new_event_loop()
+        main_task = loop.create_task(self._main(requests, results))
+
+        # The event loop runs in its own thread, so that it also works from a notebook (which already has a loop)
+        def run_loop():
+            try: loop.run_until_complete(main_task)
+            except asyncio.CancelledError: pass
+            except BaseException as error: results.put((-1, error))
+            finally: loop.close()
+        thread = threading.Thread(target=run_loop, daemon=True)
+        thread.start()
+
+        waiting = {}
+        next_position = 0
+        total = None
+        try:
+            while total is None or next_position < total:
+                if next_position in waiting:
+                    result = waiting.pop(next_position)
+                    if isinstance(result, BaseException): raise result
+                    self._call_in_loop(loop, self.window.release)
+                    next_position += 1
+                    yield result
+                    continue
+                position, result = results.get()
+                if result is _DONE: total = position
+                elif position == -1: raise result
+                else: waiting[position] = result
+        finally:
+            self._call_in_loop(loop, main_task.cancel)
+            thread.join()
+
+    @staticmethod
+    def _call_in_loop(loop: asyncio.AbstractEventLoop, callback) -> None:
+        # The loop may already be over (all requests sent)
+        try: loop.call_soon_threadsafe(callback)
+        except RuntimeError: pass
@@ -0,0 +1,42 @@
+import datetime, json, os, threading
+
+
+# Metrics of all runs (one JSON record by line: LLM requests and stage runs), elsewhere for benchmarks
+metrics_path = os.getenv("OBJECTIVE_METRICS_PATH", "../metrics/metrics.jsonl")
+
+
+class Metrics:
+    """
+    Record the LLM requests of a stage (latency, tokens, retries, cache hits) in the metrics file, one line each.
+    Tokens come from the usage given by the provider, or are estimated (and flagged so) when it is missing (see llm.count_tokens).
+    Stage runs (wall time) are recorded by run-notebook.py. Summary: report-metrics.py (`make report`).
+    """
+
+    def __init__(self, stage: str, catalog: str | None, path: str = metrics_path) -> None:
+        self.stage = stage
+        self.catalog = catalog
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def write(self, record: dict) -> None:
+        record = { "stage": self.stage, "catalog": self.catalog, **record, "date": datetime.datetime.now().isoformat(timespec='seconds') }
+        with self.lock:
+            with open(self.path, 'a') as file:
+                file.write(json.dumps(record) + "\n")
+
+    def request(
+            self, provider: str, model: str, mode: str, seconds: float | None, input_tokens: int = 0, output_tokens: int = 0,
+            estimated: bool = False, retries: int = 0, cached: bool = False, failed: bool = False
+        ) -> None:
+        """Record a request (`seconds` is None for batch requests, which have no latency of their own)."""
+        self.write({
+            "type": "request", "provider": provider, "model": model, "mode": mode,
+            "seconds": round(seconds, 3) if seconds is not None else None,
+            "input_tokens": input_tokens, "output_tokens": output_tokens, "estimated": estimated,
+            "retries": retries, "cached": cached, "failed": failed,
+        })
+
+    def stage_run(self, seconds: float, status: str) -> None:
+        """Record the run of the whole stage (status: done / failed / submitted)."""
+        self.write({ "type": "stage", "seconds": round(seconds, 3), "status": status })
@@ -0,0 +1,211 @@
+import datetime, hashlib, json, mmap, os, re, threading
+from array import array
+from typing import Dict, Iterator, List, Tuple
+
+
+# Page separator of transcription files (old direct mode transcriptions used "[Page N]")
+page_marker = re.compile(r"\n*>>>>> \[(?:PAGE|Page) (\d+)\] >>>>>\n\n")
+
+
+def clean_page(text: str) -> str:
+    """Canonical form of a page transcription, as written in transcription files."""
+    return text.replace('\n```', '').replace('—', '-').replace('\\', '\\\\').replace('```', '')
+
+
+def format_transcription(page_transcriptions: Dict[int, str]) -> str:
+    """Build the canonical transcription text (the one parsed by 11-list) from {page index: transcription}."""
+    transcription = ""
+    for page_index in sorted(page_transcriptions):
+        transcription += f"\n\n>>>>> [PAGE {page_index + 1}] >>>>>\n\n"
+        transcription += clean_page(page_transcriptions[page_index])
+    return transcription
+
+
+def parse_transcription(transcription: str) -> Dict[int, str]:
+    """Split a transcription text into {page index: page content}, in a single pass."""
+    matches = list(page_marker.finditer(transcription))
+    page_transcriptions = {}
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(transcription)
+        page_transcriptions[int(match.group(1)) - 1] = transcription[match.end():end].strip()
+    return page_transcriptions
+
+
+def _write_atomically(path: str, content: str | bytes) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb' if isinstance(content, bytes) else 'w') as file:
+        file.write(content)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_transcription(path: str, page_transcriptions: Dict[int, str], store_path: str | None = None) -> None:
+    """
+    Write the canonical transcription atomically: the file is either the previous one, or the complete new one.
+    If a store path is given, the page store is written too.
+    """
+    _write_atomically(path, format_transcription(page_transcriptions))
+    if store_path is not None:
+        PageStore.write(store_path, { i: clean_page(text).strip() for i, text in page_transcriptions.items() })
+
+
+class PageStore:
+    """
+    Transcription of a catalog, stored page by page: a JSONL file (one page by line) and an index of line offsets.
+    Page N is read without parsing the others, and a range of pages is a single read.
+    Files are `<path>.jsonl` and `<path>.idx` (8 bytes per page, missing pages having the offset of the next one).
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.offsets = array('Q')
+        with open(f"{path}.idx", 'rb') as file:
+            self.offsets.frombytes(file.read())
+        self.file = open(f"{path}.jsonl", 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] > 0 else b''
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(f"{path}.jsonl") and os.path.exists(f"{path}.idx")
+
+    @staticmethod
+    def write(path: str, page_transcriptions: Dict[int, str]) -> None:
+        """Write the store of the given {page index: page content}."""
+        nb_pages = max(page_transcriptions) + 1 if page_transcriptions else 0
+        lines = []
+        offsets = array('Q', [0])
+        for page_index in range(nb_pages):
+            if page_index in page_transcriptions:
+                lines.append(json.dumps(page_transcriptions[page_index], ensure_ascii=False).encode() + b"\n")
+            else:
+                lines.append(b"")
+            offsets.append(offsets[-1] + len(lines[-1]))
+        _write_atomically(f"{path}.jsonl", b"".join(lines))
+        _write_atomically(f"{path}.idx", offsets.tobytes())
+
+    @staticmethod
+    def import_transcription(transcription_path: str, path: str) -> None:
+        """Build the store of an existing transcription file."""
+        with open(transcription_path, 'r') as file:
+            PageStore.write(path, parse_transcription(file.read()))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def get(self, page_index: int) -> str:
+        """Content of a page (empty if the page is missing)."""
+        return ''.join(self.range(page_index, page_index + 1))
+
+    def range(self, begin: int, end: int) -> List[str]:
+        """Content of the pages from `begin` to `end` (excluded), like a slice."""
+        begin, end = max(0, begin), min(end, len(self))
+        if begin >= end: return []
+        chunk = self.data[self.offsets[begin]:self.offsets[end]]
+        contents = []
+        for page_index in range(begin, end):
+            line_begin, line_end = self.offsets[page_index] - self.offsets[begin], self.offsets[page_index + 1] - self.offsets[begin]
+            contents.append(json.loads(chunk[line_begin:line_end]) if line_end > line_begin else '')
+        return contents
+
+    def close(self) -> None:
+        if isinstance(self.data, mmap.mmap): self.data.close()
+        self.file.close()
+
+
+def page_windows(
+        page_tokens: List[int], begin: int, end: int, token_budget: int, max_pages: int | None = None, overlap: int = 0
+    ) -> Iterator[Tuple[int, int]]:
+    """
+    Group the pages from `begin` to `end` (excluded) into (window begin, window end) ranges of at most `token_budget`
+    tokens and `max_pages` pages: dense pages give small windows, sparse ones large windows. A window has at least one page.
+    If each window is sent with the `overlap` pages before it, their tokens count in its budget (not in its pages).
+    """
+    def overlap_tokens(window_begin: int) -> int:
+        return sum(page_tokens[max(0, window_begin - overlap):window_begin])
+
+    window_begin, window_tokens = begin, overlap_tokens(begin)
+    for page_index in range(begin, end):
+        tokens = page_tokens[page_index]
+        window_size = page_index - window_begin
+        if window_size > 0 and (window_tokens + tokens > token_budget or (max_pages and window_size >= max_pages)):
+            yield window_begin, page_index
+            window_begin, window_tokens = page_index, overlap_tokens(page_index)
+        window_tokens += tokens
+    if window_begin < end:
+        yield window_begin, end
+
+
+class PageJournal:
+    """
+    Append-only journal of a transcription run, one JSON record per page (status, model, timing and text).
+    Each record is flushed to disk before going to the next page, so that an interrupted run can be resumed
+    from the first missing page. A truncated last line (crash while writing) is ignored.
+    Records carry the key of the run settings (see run_key): only the pages transcribed with the same settings are resumed.
+    Once the transcription file is written, the journal is archived (see archive), so that it only resumes interrupted runs.
+    """
+
+    def __init__(self, path: str, key: str) -> None:
+        self.path = path
+        self.key = key
+        self.records: Dict[int, dict] = {}
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                content = file.read()
+            for line in content.split('\n'):
+                try: record = json.loads(line)
+                except json.JSONDecodeError: continue
+                self.records[record['page'] - 1] = record
+
+            # Terminate a truncated last line, so that it does not corrupt the next record
+            if content and not content.endswith('\n'):
+                with open(path, 'a') as file:
+                    file.write('\n')
+
+    @staticmethod
+    def run_key(input_path: str, model: str, prompt: str, settings: dict) -> str:
+        """Hash of what the page transcriptions depend on: the PDF, the model, the prompt and the rasterization settings."""
+        hasher = hashlib.sha256()
+        with open(input_path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                hasher.update(block)
+        for part in [model, prompt, json.dumps(settings, sort_keys=True)]:
+            hasher.update(b"\0")
+            hasher.update(part.encode())
+        return hasher.hexdigest()
+
+    def record(self, page_index: int, status: str, model: str, seconds: float, text: str | None = None, **infos) -> None:
+        """Journal the outcome of a page (the last record of a page wins)."""
+        record = {
+            "page": page_index + 1,
+            "status": status,
+            "model": model,
+            "key": self.key,
+            "seconds": round(seconds, 3),
+            "date": datetime.datetime.now().isoformat(timespec='seconds'),
+            **infos,
+            "text": text,
+        }
+        with self.lock:
+            with open(self.path, 'a') as file:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+            self.records[page_index] = record
+
+    def done_pages(self) -> set:
+        """Indexes of the pages successfully transcribed with the settings of this run."""
+        return set(i for i, record in self.records.items() if record['status'] == 'done' and record.get('key') == self.key)
+
+    def transcriptions(self) -> Dict[int, str]:
+        """{page index: transcription} of the pages successfully transcribed with the settings of this run."""
+        return { i: self.records[i]['text'] for i in self.done_pages() }
+
+    def archive(self) -> None:
+        """Move the journal of a complete run aside (`<path>.done`, replacing the previous one): the next run starts afresh."""
+        with self.lock:
+            if os.path.exists(self.path):
+                os.replace(self.path, f"{self.path}.done")
+            self.records = {}
@@ -0,0 +1,242 @@
+import base64, csv, math, os, time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Iterator, NamedTuple, Tuple
+import pymupdf
+from PIL import Image, ImageOps, ImageStat
+
+
+# Document and encoding settings, set once in each worker process (see _init_worker)
+_document = None
+_settings = {}
+
+# Page classification thresholds (grayscale, scan borders excluded)
+INK_LEVEL = 140                 # Darker pixels are ink
+MIDTONE_RANGE = (60, 200)       # Shades of engravings and photographs, rare on text pages (400px thumbnail)
+BLANK_MAX_STDDEV = 6            # Below this standard deviation and without any ink pixel (full resolution), the page is blank
+ILLUSTRATION_MIN_MIDTONES = 0.3 # Above this midtone ratio (and with few text lines), the page is an illustration
+ILLUSTRATION_MAX_LINES = 3      # Pages with this number of text lines or more are always sent to the model
+
+# Transcription given to pages which are not sent to the vision model
+placeholders = { "blank": "[No text]", "illustration": "[Image]" }
+
+
+class Page(NamedTuple):
+    """A rendered page. The image is None when the page does not need to be sent (its placeholder is then set)."""
+    index: int
+    b64_image: str | None
+    kind: str
+    placeholder: str | None
+
+
+def _init_worker(pdf_path: str, settings: dict) -> None:
+    """Pool initializer: open the PDF once per worker, instead of once per page."""
+    global _document, _settings
+    _document = pymupdf.open(pdf_path)
+    _settings = settings
+
+
+def crop_margins(img: Image.Image, threshold: int = 200, padding: float = 0.02) -> Image.Image:
+    """Crop the blank margins of a scan: keep the bounding box of pixels darker than `threshold`, plus some padding."""
+    ink = ImageOps.invert(img.convert("L")).point(lambda p: 255 if p > 255 - threshold else 0)
+    bbox = ink.getbbox()
+    if bbox is None: return img
+    pad_x, pad_y = int(img.width * padding), int(img.height * padding)
+    return img.crop((
+        max(0, bbox[0] - pad_x), max(0, bbox[1] - pad_y),
+        min(img.width, bbox[2] + pad_x), min(img.height, bbox[3] + pad_y)
+    ))
+
+
+def count_text_lines(gray: Image.Image) -> int:
+    """Count runs of rows holding some ink (but not full of it), separated by empty rows: text lines look like this."""
+    mask = gray.point(lambda p: 255 if p < INK_LEVEL else 0)
+    rows = list(mask.resize((1, mask.height), Image.BOX).getdata())
+    lines, in_line = 0, False
+    for row in rows:
+        is_text_row = 0.01 * 255 < row < 0.6 * 255
+        if is_text_row and not in_line: lines += 1
+        in_line = is_text_row
+    return lines
+
+
+def classify_page(img: Image.Image) -> str:
+    """Cheap local guess of the content of a scan: "blank", "illustration" or "text"."""
+
+    # Work in grayscale, without the borders of the scan (shadows, edges of the book)
+    gray = img.convert("L")
+    width, height = gray.size
+    gray = gray.crop((int(width * 0.05), int(height * 0.05), int(width * 0.95), int(height * 0.95)))
+
+    # Blank: no stroke at all, at full resolution (thin strokes of a single text line get lighter once downscaled)
+    if sum(gray.histogram()[:INK_LEVEL]) == 0 and ImageStat.Stat(gray).stddev[0] < BLANK_MAX_STDDEV:
+        return "blank"
+
+    # Illustrations are told from text on a small version
+    gray.thumbnail((400, 400))
+    histogram = gray.histogram()
+    midtone_ratio = sum(histogram[MIDTONE_RANGE[0]:MIDTONE_RANGE[1]]) / sum(histogram)
+    if midtone_ratio > ILLUSTRATION_MIN_MIDTONES and count_text_lines(gray) < ILLUSTRATION_MAX_LINES:
+        return "illustration"
+    return "text"
+
+
+def render_page(page, dpi: int | None = None, grayscale: bool = False) -> Image.Image:
+    """Render a PDF page into an image, directly in shades of gray if asked (smaller and faster than converting afterward)."""
+    colorspace = pymupdf.csGRAY if grayscale else pymupdf.csRGB
+    pix = page.get_pixmap(dpi=dpi, colorspace=colorspace) if dpi else page.get_pixmap(colorspace=colorspace)
+    return Image.frombytes("L" if grayscale else "RGB", [pix.width, pix.height], pix.samples)
+
+
+def encode_image(img: Image.Image, crop: bool = False, jpeg_quality: int = 75, max_long_edge: int | None = None) -> Tuple[bytes, int, int]:
+    """Encode a page image into JPEG, and return it with its final dimensions."""
+    if crop:
+        img = crop_margins(img)
+    if max_long_edge and max(img.size) > max_long_edge:
+        img.thumbnail((max_long_edge, max_long_edge))
+
+    buffered = BytesIO()
+    img.save(buffered, format="JPEG", quality=jpeg_quality, optimize=True)
+    return buffered.getvalue(), img.width, img.height
+
+
+def encode_page(page, dpi: int | None = None, grayscale: bool = False, crop: bool = False, jpeg_quality: int = 75, max_long_edge: int | None = None) -> Tuple[bytes, int, int]:
+    """Render a PDF page into a JPEG image, and return it with its final dimensions."""
+    img = render_page(page, dpi=dpi, grayscale=grayscale)
+    return encode_image(img, crop=crop, jpeg_quality=jpeg_quality, max_long_edge=max_long_edge)
+
+
+def _render_page(page_index: int) -> Tuple[Page, int, int, int]:
+    """Render a single page of the opened document into a base64 JPEG image, unless it can be skipped."""
+    img = render_page(_document[page_index], dpi=_settings.get('dpi'), grayscale=_settings.get('grayscale', False))
+
+    # Blank and illustration pages are detected on the rendered image, before encoding it
+    kind = "text"
+    if _settings.get('skip_blank_pages') or _settings.get('skip_illustration_pages'):
+        kind = classify_page(img)
+        if _settings.get(f'skip_{kind}_pages'):
+            return Page(page_index, None, kind, placeholders[kind]), 0, 0, 0
+
+    jpeg, width, height = encode_image(
+        img, crop=_settings.get('crop_margins', False),
+        jpeg_quality=_settings.get('jpeg_quality', 75), max_long_edge=_settings.get('max_long_edge')
+    )
+    return Page(page_index, base64.b64encode(jpeg).decode(), kind, None), len(jpeg), width, height
+
+
+def estimate_image_tokens(width: int, height: int, provider: str, detail: str = "high") -> int:
+    """Rough estimate of the number of input tokens an image costs, following each provider documentation."""
+
+    # Mistral (pixtral): one token per 16x16 patch, plus one per row, image being downscaled to 1024px at most
+    if provider == "mistralai":
+        ratio = min(1, 1024 / max(width, height))
+        columns, rows = math.ceil(width * ratio / 16), math.ceil(height * ratio / 16)
+        return columns * rows + rows
+
+    # OpenAI (and default): 85 tokens, plus 170 per 512px tile once fitted in 2048px and shortest side at 768px
+    if detail == "low": return 85
+    ratio = min(1, 2048 / max(width, height))
+    width, height = width * ratio, height * ratio
+    ratio = min(1, 768 / min(width, height))
+    width, height = width * ratio, height * ratio
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+class Rasterizer:
+    """
+    Transform the pages of a PDF into base64 JPEG images, ready to be sent to a vision model.
+    Pages are rendered in a process pool, only a small window of rendered pages being kept in memory at once.
+    Encoding is set by the `rasterization` section of the configuration (DPI, grayscale, margin cropping, JPEG quality, maximum size).
+    """
+
+    def __init__(
+            self, pdf_path: str, workers: int | None = None,
+            dpi: int | None = None, grayscale: bool = False, crop_margins: bool = False,
+            jpeg_quality: int = 75, max_long_edge: int | None = None, detail: str = "high",
+            skip_blank_pages: bool = False, skip_illustration_pages: bool = False, provider: str = "openai"
+        ) -> None:
+        self.pdf_path = pdf_path
+        self.workers = workers or os.cpu_count() or 1
+        self.detail = detail
+        self.provider = provider
+        self.settings = {
+            'dpi': dpi, 'grayscale': grayscale, 'crop_margins': crop_margins, 'jpeg_quality': jpeg_quality, 'max_long_edge': max_long_edge,
+            'skip_blank_pages': skip_blank_pages, 'skip_illustration_pages': skip_illustration_pages
+        }
+        self.page_stats = []
+
+    def page_count(self) -> int:
+        """Number of pages of the PDF."""
+        with pymupdf.open(self.pdf_path) as doc:
+            return doc.page_count
+
+    def iter_pages(self, page_begin: int = 0, page_end: int | None = None) -> Iterator[Page]:
+        """Render the pages and yield them in page order."""
+
+        if page_end is None: page_end = self.page_count()
+        window = 2 * self.workers
+        page_indexes = iter(range(page_begin, page_end))
+        begin_time = time.time()
+        self.page_stats = []
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(self.pdf_path, self.settings)) as pool:
+
+            # Fill the window
+            pending = deque()
+            for page_index in page_indexes:
+                pending.append(pool.submit(_render_page, page_index))
+                if len(pending) >= window: break
+
+            # Yield pages in order, refilling the window as they are consumed
+            while pending:
+                page, nb_bytes, width, height = pending.popleft().result()
+                next_index = next(page_indexes, None)
+                if next_index is not None:
+                    pending.append(pool.submit(_render_page, next_index))
+                self.page_stats.append({
+                    "page": page.index + 1, "kind": page.kind, "skipped": page.placeholder is not None,
+                    "width": width, "height": height, "bytes": nb_bytes,
+                    "tokens": estimate_image_tokens(width, height, self.provider, self.detail) if nb_bytes else 0
+                })
+                yield page
+
+        self.report(time.time() - begin_time)
+
+    def report(self, elapsed: float) -> None:
+        """Print the rasterization speed and the payload sent by page."""
+        nb_pages = len(self.page_stats)
+        if nb_pages == 0: return
+        elapsed = max(elapsed, 1e-6)
+        sent = [stat for stat in self.page_stats if not stat['skipped']] or [{ 'bytes': 0, 'tokens': 0 }]
+        avg_bytes = sum(stat['bytes'] for stat in sent) / len(sent)
+        avg_tokens = sum(stat['tokens'] for stat in sent) / len(sent)
+        print(f'{nb_pages} pages rasterized in {round(elapsed, 1)}s ({round(nb_pages / elapsed, 2)} pages/sec, {self.workers} workers)')
+        print(f'Payload by page: {round(avg_bytes / 1024, 1)} KB, ~{round(avg_tokens)} image tokens ({self.provider}, detail: {self.detail})')
+        for kind in placeholders:
+            nb_skipped = len([stat for stat in self.page_stats if stat['skipped'] and stat['kind'] == kind])
+            if nb_skipped > 0:
+                print(f'{nb_skipped} {kind} pages not sent to the model ({round(100 * nb_skipped / nb_pages, 1)}%)')
+
+    def save_page_stats(self, path: str) -> None:
+        """Save the size of each page image (dimensions, bytes, estimated tokens) in a CSV file."""
+        with open(path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=['page', 'kind', 'skipped', 'width', 'height', 'bytes', 'tokens'])
+            writer.writeheader()
+            writer.writerows(self.page_stats)
+
+
+# Check the page classification on synthetic pages (a page with a single line of text must never be blank)
+# Usage: python raster.py
+if __name__ == '__main__':
+    doc = pymupdf.open()
+    for nb_lines in [0, 1, 3, 5]:
+        page = doc.new_page()
+        for line in range(nb_lines):
+            page.insert_text((72, 120 + 14 * line), f"Suite du lot 123, ligne {line + 1}.", fontsize=10)
+    for dpi in [72, 150, 200, 300]:
+        for page, nb_lines in zip(doc, [0, 1, 3, 5]):
+            kind = classify_page(render_page(page, dpi=dpi))
+            expected = "blank" if nb_lines == 0 else "text"
+            print(f'{nb_lines} lines at {dpi} dpi: {kind}')
+            if kind != expected: raise Exception(f'Page with {nb_lines} lines at {dpi} dpi classified as "{kind}" instead of "{expected}"')
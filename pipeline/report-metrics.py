@@ -0,0 +1,94 @@
+import argparse, json, os, sys
+from collections import defaultdict
+import yaml
+from metrics import metrics_path
+
+# Summarize the metrics file: latency percentiles, tokens, cache hits and retries by stage and model,
+# wall time and throughput by stage, and estimated cost by catalog (prices from 00-config.yaml).
+# Usage: python report-metrics.py [--catalog name] [--since 2025-01-31] [--path ../metrics/metrics.jsonl]
+
+
+def percentile(values: list, ratio: float) -> float | None:
+    """Percentile of the values, nearest rank (None if there are none)."""
+    if len(values) == 0: return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(ratio * len(values)) - 1))]
+
+
+def cost(record: dict, prices: dict) -> float:
+    """Estimated cost of a request, in USD."""
+    if record['cached'] or record['model'] not in prices['models']: return 0
+    input_price, output_price = prices['models'][record['model']]
+    factor = prices['batch_factor'] if record['mode'] == 'batch' else 1
+    return factor * (record['input_tokens'] * input_price + record['output_tokens'] * output_price) / 1_000_000
+
+
+def seconds_str(seconds: float | None) -> str:
+    return f'{seconds:.2f}' if seconds is not None else '-'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--catalog', help='only this catalog')
+    parser.add_argument('--since', help='only records from this date (YYYY-MM-DD)')
+    parser.add_argument('--path', default=metrics_path)
+    args = parser.parse_args()
+
+    with open("./00-config.yaml", "r") as f:
+        config = yaml.safe_load(f)
+    prices = config['prices']
+
+    if not os.path.exists(args.path):
+        print(f'No metrics yet (<{args.path}>)')
+        sys.exit()
+    requests, stage_runs = [], []
+    with open(args.path, 'r') as file:
+        for line in file:
+            try: record = json.loads(line)
+            except json.JSONDecodeError: continue
+            if args.catalog and record['catalog'] != args.catalog: continue
+            if args.since and record['date'] < args.since: continue
+            (requests if record['type'] == 'request' else stage_runs).append(record)
+    print(f'{len(requests)} LLM requests and {len(stage_runs)} stage runs in <{args.path}>')
+
+    # Requests by stage and model
+    print('\n### Requests')
+    print(f"{'stage':<18}{'model':<24}{'mode':<8}{'requests':>9}{'cached':>8}{'failed':>7}{'retries':>8}{'p50 s':>8}{'p90 s':>8}{'p99 s':>8}{'in tok':>11}{'out tok':>10}{'est.':>6}")
+    groups = defaultdict(list)
+    for record in requests: groups[(record['stage'], record['model'], record['mode'])].append(record)
+    for (stage, model, mode), records in sorted(groups.items()):
+        sent = [record for record in records if not record['cached']]
+        latencies = [record['seconds'] for record in sent if record['seconds'] is not None and not record['failed']]
+        estimated = len([record for record in sent if record['estimated']])
+        print(
+            f"{stage:<18}{model:<24}{mode:<8}{len(records):>9}"
+            f"{round(100 * (len(records) - len(sent)) / len(records)):>7}%{len([record for record in sent if record['failed']]):>7}"
+            f"{sum(record['retries'] for record in sent):>8}"
+            f"{seconds_str(percentile(latencies, 0.5)):>8}{seconds_str(percentile(latencies, 0.9)):>8}{seconds_str(percentile(latencies, 0.99)):>8}"
+            f"{sum(record['input_tokens'] for record in sent):>11}{sum(record['output_tokens'] for record in sent):>10}"
+            f"{round(100 * estimated / len(sent)) if sent else 0:>5}%"
+        )
+
+    # Stages: wall time, throughput and cost
+    print('\n### Stages')
+    # Runs are the complete ones (done or failed), batch submissions are counted apart (their wall time is included)
+    print(f"{'stage':<18}{'runs':>6}{'failed':>7}{'subm.':>6}{'wall time s':>13}{'requests':>9}{'tokens/s':>10}{'cost $':>10}")
+    stages = sorted(set(record['stage'] for record in requests + stage_runs))
+    for stage in stages:
+        runs = [run for run in stage_runs if run['stage'] == stage]
+        records = [record for record in requests if record['stage'] == stage]
+        wall_time = sum(run['seconds'] for run in runs)
+        tokens = sum(record['input_tokens'] + record['output_tokens'] for record in records)
+        print(
+            f"{stage:<18}{len([run for run in runs if run['status'] != 'submitted']):>6}{len([run for run in runs if run['status'] == 'failed']):>7}"
+            f"{len([run for run in runs if run['status'] == 'submitted']):>6}{wall_time:>13.1f}{len(records):>9}"
+            f"{(tokens / wall_time if wall_time else 0):>10.1f}{sum(cost(record, prices) for record in records):>10.3f}"
+        )
+
+    # Cost by catalog
+    print('\n### Cost by catalog (estimated)')
+    costs = defaultdict(lambda: defaultdict(float))
+    for record in requests: costs[record['catalog']][record['stage']] += cost(record, prices)
+    for catalog in sorted(costs, key=lambda catalog: str(catalog)):
+        details = ', '.join(f'{stage}: {value:.3f}' for stage, value in sorted(costs[catalog].items()) if value > 0)
+        print(f"{str(catalog):<40}{sum(costs[catalog].values()):>10.3f} $" + (f'  ({details})' if details else ''))
@@ -0,0 +1,176 @@
+import heapq, re
+from typing import Dict, List
+import yaml
+import lib
+
+
+def as_list(value) -> list:
+    return value if isinstance(value, list) else [value]
+
+
+def expand(rule, value: str):
+    """Copy of a `for_each` rule, with {value} replaced in all its texts."""
+    if isinstance(rule, dict): return { key: expand(item, value) for key, item in rule.items() }
+    if isinstance(rule, list): return [expand(item, value) for item in rule]
+    if isinstance(rule, str): return rule.replace('{value}', value)
+    return rule
+
+
+def words_regex(words: List[str]) -> str:
+    """Regex of the words as a trie (common beginnings are tested once), the longest word first where they overlap."""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word: node = node.setdefault(char, {})
+        node[''] = {}
+    def build(node: dict) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char != '']
+        if len(branches) == 0: return ''
+        regex = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return f'(?:{regex})?' if '' in node else regex
+    return build(trie)
+
+
+class Rules:
+    """
+    Keyword rules of a step, declared in 03-rules.yaml (see the head of the file for their syntax).
+    Words of the description used by all rules are compiled into a single regex: each description is scanned once,
+    whatever the number of rules, and only the rules triggered by the words found or by the elements of the fields are checked.
+    Multi-value fields are handled as lists of elements, with the same behavior as lib.add_element and lib.remove_element.
+    """
+
+    def __init__(self, rules: list) -> None:
+        self.words = set()
+        self.rules = []
+        for rule in rules:
+            if 'for_each' in rule:
+                self.rules += [expand({ key: item for key, item in rule.items() if key != 'for_each' }, value) for value in rule['for_each']]
+            else:
+                self.rules.append(rule)
+        self.rules = [self.compile(rule) for rule in self.rules]
+
+        # Rules are indexed by a condition they need (a word of the description, or an element of a field),
+        # only the rules whose condition may hold are then checked for a line
+        self.triggers = {}
+        self.always = []
+        for index, rule in enumerate(self.rules):
+            keys = self.trigger_keys(rule)
+            if keys is None: self.always.append(index)
+            for key in keys or []: self.triggers.setdefault(key, []).append(index)
+
+        # Each word found also means all the words it contains are there (the regex only gives the longest one at each position)
+        words = sorted(self.words)
+        self.regex = re.compile(f'(?=({words_regex(words)}))') if len(words) > 0 else None
+        self.contained = { word: set(other for other in words if other in word) for word in words }
+        self.map_cache = {}
+
+    @staticmethod
+    def load(path: str, section: str) -> 'Rules':
+        with open(path, "r") as f:
+            return Rules(yaml.safe_load(f)[section])
+
+    def compile(self, rule: dict) -> dict:
+        if 'map' in rule:
+            return { "map": rule['map'], "terms": [{
+                "match": as_list(term['match']), "and": as_list(term.get('and', [])), "unless": as_list(term.get('unless', [])), "to": term['to']
+            } for term in rule['terms']] }
+        return {
+            "conditions": self.compile_conditions(rule),
+            "remove": { field: [str(value).lower() for value in as_list(values)] for field, values in rule.get('remove', {}).items() },
+            "add": { field: [str(value).lower().strip() for value in as_list(values)] for field, values in rule.get('add', {}).items() },
+        }
+
+    @staticmethod
+    def trigger_keys(rule: dict) -> list | None:
+        """Keys of a condition needed by the rule (None if it has none, and must always be checked)."""
+        for condition in rule.get('conditions', []):
+            if condition[0] == 'description': return [('word', word) for word in condition[1]]
+            if condition[0] == 'has': return [('has', condition[1], value) for value in condition[2]]
+        return None
+
+    def compile_conditions(self, rule: dict) -> list:
+        conditions = []
+        for kind in ['description', 'not_description']:
+            if kind in rule:
+                words = [str(word) for word in as_list(rule[kind])]
+                self.words.update(words)
+                conditions.append((kind, words))
+        for kind in ['has', 'contains']:
+            for field, values in rule.get(kind, {}).items():
+                conditions.append((kind, field, [str(value) for value in as_list(values)]))
+        if 'any' in rule:
+            conditions.append(('any', [self.compile_conditions(group) for group in rule['any']]))
+        return conditions
+
+    def found_words(self, description: str) -> set:
+        """Words of the rules which are in the description, in a single scan."""
+        if self.regex is None: return set()
+        found = set()
+        for match in set(self.regex.findall(description)):
+            found |= self.contained[match]
+        return found
+
+    def holds(self, conditions: list, found: set, fields: Dict[str, list]) -> bool:
+        for condition in conditions:
+            kind = condition[0]
+            if kind == 'description' and not any(word in found for word in condition[1]): return False
+            if kind == 'not_description' and any(word in found for word in condition[1]): return False
+            if kind == 'has' and not any(value in fields[condition[1]] for value in condition[2]): return False
+            if kind == 'contains' and not any(word in element for element in fields[condition[1]] for word in condition[2]): return False
+            if kind == 'any' and not any(self.holds(group, found, fields) for group in condition[1]): return False
+        return True
+
+    def map_element(self, rule: dict, element: str) -> list:
+        """Replacements of an element by a `map` rule (each distinct element is only matched once)."""
+        key = (id(rule), element)
+        if key not in self.map_cache:
+            text = " " + element.lower()
+            self.map_cache[key] = [
+                term['to'] for term in rule['terms']
+                if any(word in text for word in term['match'])
+                and (len(term['and']) == 0 or any(word in text for word in term['and']))
+                and not any(word in text for word in term['unless'])
+            ]
+        return self.map_cache[key]
+
+    def trigger(self, queue: list, index: int, field: str, added: list) -> None:
+        """Queue the next rules triggered by the elements added to a field by the rule at `index`."""
+        for value in added:
+            for triggered in self.triggers.get(('has', field, value), []):
+                if triggered > index: heapq.heappush(queue, triggered)
+
+    def apply(self, description: str, values: Dict[str, str]) -> Dict[str, str]:
+        """
+        Apply the rules to a line: `description` and `values` (multi-value fields, '' when empty) are in lower case.
+        Return the new values of the fields, cleaned (lib.clean_elements_str).
+        """
+        found = self.found_words(description)
+        fields = { field: value.split(', ') if value else [] for field, value in values.items() }
+
+        # Rules to check, in order: always checked ones, and those triggered by the words and elements of the line
+        keys = [('word', word) for word in found] + [('has', field, element) for field, elements in fields.items() for element in elements]
+        queue = self.always + [index for key in keys for index in self.triggers.get(key, [])]
+        heapq.heapify(queue)
+        last = -1
+        while len(queue) > 0:
+            index = heapq.heappop(queue)
+            if index == last: continue
+            last = index
+            rule = self.rules[index]
+            if 'map' in rule:
+                field = rule['map']
+                replaced = { element: self.map_element(rule, element) for element in fields[field] }
+                removed = [element for element, replacements in replaced.items() if len(replacements) > 0]
+                if len(removed) > 0:
+                    kept = [element for element in fields[field] if not any(word in element for word in removed)]
+                    added = [replacement for replacements in replaced.values() for replacement in replacements]
+                    fields[field] = lib.clean_elements(kept + added)
+                    self.trigger(queue, index, field, added)
+                continue
+            if not self.holds(rule['conditions'], found, fields): continue
+            for field, words in rule['remove'].items():
+                fields[field] = lib.clean_elements([element for element in fields[field] if not any(word in element for word in words)])
+            for field, new_values in rule['add'].items():
+                fields[field] = lib.clean_elements(fields[field] + new_values)
+                self.trigger(queue, index, field, new_values)
+        return { field: lib.clean_elements_str(', '.join(elements)) for field, elements in fields.items() }
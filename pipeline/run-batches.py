@@ -0,0 +1,89 @@
+import argparse, os, subprocess, sys, time
+from concurrent.futures import ThreadPoolExecutor
+import yaml
+import batch
+import llm
+
+# Run a batch stage (10, 11 or 12) on many catalogues at once:
+# 1. each catalogue runs the stage until its batch is submitted (several catalogues at the same time),
+# 2. a single poller follows all the batches, and downloads the results of each one as soon as it is over,
+# 3. the stage is run again for this catalogue, which reattaches to its downloaded batch and finishes.
+# Usage: python run-batches.py <notebook> <catalog>[:begin[:end]] ... [--parallel 4]
+
+# Name of the batch task of each stage (f"{catalog}_{task}")
+stage_tasks = {
+    "10-transcription.ipynb": "transcription",
+    "11-list.ipynb": "list",
+    "12-objects.ipynb": "objects",
+}
+
+
+def run_stage(notebook: str, catalog: str, submit_only: bool) -> subprocess.CompletedProcess:
+    """Run the stage notebook for a catalogue, in its own process (output is kept, to be printed at once)."""
+    name, begin, end = (catalog.split(':') + ['', ''])[:3]
+    env = {
+        **os.environ,
+        "OBJECTIVE_MODE": "pipeline", "OBJECTIVE_CATALOG": name, "OBJECTIVE_PAGE_BEGIN": begin, "OBJECTIVE_PAGE_END": end,
+        "OBJECTIVE_BATCH_SUBMIT_ONLY": "yes" if submit_only else "no"
+    }
+    return subprocess.run([sys.executable, "run-notebook.py", notebook], env=env, capture_output=True, text=True)
+
+
+def print_run(catalog: str, step: str, run: subprocess.CompletedProcess) -> None:
+    print(f'----- [{catalog}] {step} (exit code {run.returncode})')
+    print(run.stdout, end='')
+    if run.returncode not in [0, batch.SUBMITTED_EXIT_CODE]:
+        print(run.stderr, end='')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('notebook', choices=list(stage_tasks))
+    parser.add_argument('catalogs', nargs='+', help='catalog folder names, with begin and end pages for 11-list (catalog:begin:end)')
+    parser.add_argument('--parallel', type=int, default=4, help='number of stages run at the same time')
+    args = parser.parse_args()
+
+    with open("./00-config.yaml", "r") as f:
+        config = yaml.safe_load(f)
+    llm_provider = config['model']['llm_provider']
+    llm_server = os.getenv('OBJECTIVE_LLM_SERVER') or config['model']['llm_server']
+    adapter = batch.adapter(llm_provider, llm.client(llm_provider, llm_server), config['model']['language_model'])
+    begin_time = time.time()
+    failures = []
+
+    # Submit the batches of all catalogues
+    print(f'### Submitting {len(args.catalogs)} batches')
+    pending = {}
+    with ThreadPoolExecutor(max_workers=args.parallel) as pool:
+        runs = pool.map(lambda catalog: run_stage(args.notebook, catalog, submit_only=True), args.catalogs)
+        for catalog, run in zip(args.catalogs, runs):
+            print_run(catalog, 'submission', run)
+            name = catalog.split(':')[0]
+            if run.returncode == batch.SUBMITTED_EXIT_CODE:
+                task_name = f"{name}_{stage_tasks[args.notebook]}"
+                job = batch.BatchJob.load(adapter, task_name)
+                if job is None:
+                    print(f'[{catalog}] batch submitted, but no job of {task_name} in the batch registry <{batch.registry_path}>')
+                    failures.append(catalog)
+                    continue
+                pending[job] = catalog
+            elif run.returncode != 0:
+                failures.append(catalog)
+
+    # Follow all batches at once, and finish the stage of each catalogue as soon as its batch is over
+    print(f'### Waiting for {len(pending)} batches')
+    with ThreadPoolExecutor(max_workers=args.parallel) as pool:
+        finishing = {}
+        for job in batch.Poller(pending).run():
+            catalog = pending[job]
+            print(f'Batch of {catalog} is over ({round(time.time() - begin_time)}s), finishing the stage')
+            finishing[catalog] = pool.submit(run_stage, args.notebook, catalog, False)
+        for catalog, future in finishing.items():
+            run = future.result()
+            print_run(catalog, 'results', run)
+            if run.returncode != 0: failures.append(catalog)
+
+    print(f'### {len(args.catalogs)} catalogues in {round(time.time() - begin_time)}s')
+    if len(failures) > 0:
+        print('Failed:', ', '.join(failures))
+        sys.exit(1)
@@ -1,32 +1,54 @@
-import sys, json
-
-# Get the notebook file path
-if len(sys.argv) != 2:
-    print("Usage: python run-notebook.py <notebook_path>")
-    sys.exit(1)
-else:
-    nb_path = sys.argv[1]
-
-
-nb_file = open(nb_path, 'r')
-nb_file_content = nb_file.read()
-nb_file.close()
-
-nb = json.loads(nb_file_content)
-
-for i, cell in enumerate(nb['cells']):
-
-    if cell['cell_type'] == 'markdown':
-        for line in cell['source']:
-            print(line.strip())
-
-    if cell['cell_type'] == 'code' and 'source' in cell:
-        try:
-            exec(''.join(cell['source']))
-        except BaseException as error:
-            print('')
-            print(f'Error while running cell number {i}. Code is')
-            for j, line in enumerate(cell['source']):
-                print(str(j + 1).rjust(3) + ": " + line, end='')
-            print('\n')
-            raise error
\ No newline at end of file
+import sys, json, os, time
+from batch import SUBMITTED_EXIT_CODE
+from metrics import Metrics
+
+# Guard: worker processes (process pools) re-import this file, they must not re-run the notebook
+if __name__ == '__main__':
+
+    # Get the notebook file path
+    if len(sys.argv) != 2:
+        print("Usage: python run-notebook.py <notebook_path>")
+        sys.exit(1)
+    else:
+        nb_path = sys.argv[1]
+
+
+    nb_file = open(nb_path, 'r')
+    nb_file_content = nb_file.read()
+    nb_file.close()
+
+    nb = json.loads(nb_file_content)
+
+    # Wall time of the stage, in the metrics file (names are prefixed, cells run in this scope)
+    run_metrics = Metrics(os.path.splitext(os.path.basename(nb_path))[0], os.getenv('OBJECTIVE_CATALOG'))
+    run_begin_time = time.time()
+    run_status = 'failed'
+    try:
+        for i, cell in enumerate(nb['cells']):
+
+            if cell['cell_type'] == 'markdown':
+                for line in cell['source']:
+                    print(line.strip())
+
+            if cell['cell_type'] == 'code' and 'source' in cell:
+                try:
+                    exec(''.join(cell['source']))
+
+                # The notebook asked to stop here (eg: batch submitted, its results being collected later)
+                except SystemExit:
+                    raise
+                except BaseException as error:
+                    print('')
+                    print(f'Error while running cell number {i}. Code is')
+                    for j, line in enumerate(cell['source']):
+                        print(str(j + 1).rjust(3) + ": " + line, end='')
+                    print('\n')
+                    raise error
+        run_status = 'done'
+
+    # Stopped on purpose (batch submitted, the stage being run again to collect its results), or exited with an error code
+    except SystemExit as stop:
+        run_status = 'done' if not stop.code else 'submitted' if stop.code == SUBMITTED_EXIT_CODE else 'failed'
+        raise
+    finally:
+        run_metrics.stage_run(time.time() - run_begin_time, run_status)
@@ -0,0 +1,302 @@
+import argparse, email.parser, hashlib, json, re, threading, time, uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local server standing in for the LLM providers, to measure the pipeline without paying for API calls
+# (or without an Ollama server). It answers like OpenAI and MistralAI (chat completions, files, batches)
+# and like Ollama (/api/chat), with deterministic answers built from the prompts of the pipeline stages.
+# Latency, failure rate and rate limit can be set. Request counters: GET /stats.
+# Usage: python stand-in-server.py [--port 8765] [--latency 0.05] [--failure-rate 0] [--rate-limit 20] [--batch-latency 2]
+
+# Vocabulary of synthetic answers (also used to build synthetic catalogs, see benchmark-pipeline.py)
+object_types = ["vase", "plat", "assiette", "statuette", "coffret", "pendule", "commode", "miroir", "tapisserie", "bougeoir"]
+materials = ["porcelaine", "bronze", "bois sculpté", "argent", "marbre", "ivoire", "soie brodée", "émail peint", "laque", "faïence"]
+origins = ["Chine", "Japon", "France", "Italie", "Allemagne", "Perse", "Inde", "Flandres"]
+
+
+def digest(*parts: str) -> int:
+    """Deterministic number from the given texts."""
+    return int(hashlib.sha256('\n'.join(parts).encode()).hexdigest()[:12], 16)
+
+
+def transcribe_page(b64_image: str) -> str:
+    """Synthetic transcription of a page, always the same for the same image."""
+    seed = digest(b64_image)
+    first_lot = seed % 900 + 1
+    lots = []
+    for i in range(3 + seed % 4):
+        seed = digest(str(seed))
+        lots.append(
+            f"{first_lot + i} - {object_types[seed % len(object_types)].capitalize()} en {materials[seed // 7 % len(materials)]}, "
+            f"{origins[seed // 13 % len(origins)]}. Haut. {seed % 60 + 5} cm."
+        )
+    return f"[page number: {seed % 300 + 1}]\n" + '\n\n'.join(lots)
+
+
+def list_objects(prompt: str) -> str:
+    """Answer of the object list step: the lines of the extract looking like a lot."""
+    extract = prompt[prompt.find('Here is the extract:'):]
+    return '\n'.join(line.strip() for line in extract.split('\n') if re.match(r'^\s*\d+\s*[-.]', line))
+
+
+def extract_objects(prompt: str) -> str:
+    """Answer of the information extraction step: a JSON array, with one object by description."""
+    match = re.search(r'Here are the \d+ descriptions:\n"(.*)"\s*$', prompt, re.DOTALL)
+    descriptions = [line.strip() for line in (match.group(1) if match else '').split('\n') if line.strip() != '']
+    objects = []
+    for description in descriptions:
+        lower = description.lower()
+        index = re.match(r'^\s*(\d+)', description)
+        objects.append({
+            "description": description,
+            "index": [index.group(1)] if index else [],
+            "object_type": [word for word in object_types if word in lower][:1] or [lower.split(' - ')[-1].split(' ')[0]],
+            "number": ["1"],
+            "material_technique": [material for material in materials if material in lower],
+            "origin": [origin for origin in origins if origin.lower() in lower],
+        })
+    return "```json\n" + json.dumps(objects, ensure_ascii=False, indent=2) + "\n```"
+
+
+def answer_question(prompt: str) -> str:
+    """Answer of a yes / no question about a description: yes if the questioned term is in the description."""
+    for question in [r'main object is an? (.+?)', r'main object is made of (.+?)', r'main object comes from (.+?)', r'say that (.+?) is the author']:
+        match = re.search(question + r'\?\s*Here is the description: "(.*)"\nAnswer', prompt, re.DOTALL)
+        if match: break
+    if match is None: return "no"
+    term, description = match.group(1).lower().rstrip('s'), match.group(2).lower()
+    return "yes" if term in description else "no"
+
+
+def answer(messages: list, json_format: bool = False) -> str:
+    """Deterministic answer to the messages, following the prompts of the pipeline stages."""
+    message = messages[-1] if messages else {}
+    content = message.get('content', '')
+    images = list(message.get('images') or [])
+    if isinstance(content, list):
+        for part in content:
+            if part.get('type') == 'image_url':
+                url = part['image_url']['url'] if isinstance(part['image_url'], dict) else part['image_url']
+                images.append(url.split(',')[-1])
+        content = '\n'.join(part.get('text', '') for part in content if part.get('type') == 'text')
+
+    if len(images) > 0: text = transcribe_page(images[0])
+    elif 'list me all objects' in content: text = list_objects(content)
+    elif 'extract me the following information' in content: text = extract_objects(content)
+    elif '"yes" or "no"' in content: text = answer_question(content)
+    else: text = "OK"
+    return json.dumps({ "answer": text }) if json_format else text
+
+
+class StandIn:
+    """State of the server: files, batches, counters, and the failure and rate limit behaviours."""
+
+    def __init__(self, latency: float, failure_rate: float, rate_limit: float | None, batch_latency: float) -> None:
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rate_limit = rate_limit
+        self.batch_latency = batch_latency
+        self.lock = threading.Lock()
+        self.files = {}
+        self.batches = {}
+        self.attempts = {}
+        self.stats = { "requests": 0, "chat": 0, "ollama": 0, "batch_requests": 0, "files": 0, "batches": 0, "errors_429": 0, "errors_500": 0 }
+        self.tokens = rate_limit or 0
+        self.updated = time.monotonic()
+
+    def count(self, key: str, nb: int = 1) -> None:
+        with self.lock:
+            self.stats[key] += nb
+
+    def rate_limited(self) -> bool:
+        """Token bucket of `rate_limit` requests per second."""
+        if not self.rate_limit: return False
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate_limit, self.tokens + (now - self.updated) * self.rate_limit)
+            self.updated = now
+            if self.tokens < 1: return True
+            self.tokens -= 1
+            return False
+
+    def fails(self, body: bytes) -> bool:
+        """Deterministic failures: the n-th attempt of a same request always fails (or not) the same way."""
+        if self.failure_rate <= 0: return False
+        key = hashlib.sha256(body).hexdigest()
+        with self.lock:
+            attempt = self.attempts.get(key, 0)
+            self.attempts[key] = attempt + 1
+        return digest(key, str(attempt)) % 10000 < self.failure_rate * 10000
+
+    def add_file(self, name: str, content: bytes, purpose: str) -> dict:
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        infos = {
+            "id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()), "filename": name,
+            "purpose": purpose, "status": "processed", "sample_type": "batch_request" if purpose == "batch" else "batch_result",
+            "source": "upload", "num_lines": content.count(b"\n")
+        }
+        with self.lock:
+            self.files[file_id] = (infos, content)
+        return infos
+
+    def batch_status(self, batch_id: str) -> dict:
+        """Batches are over `batch_latency` seconds after their creation: their output is built at that time."""
+        with self.lock:
+            job = self.batches[batch_id]
+        if job['output'] is None and time.time() - job['created'] >= self.batch_latency:
+            lines = []
+            requests = self.files[job['input_file']][1].decode().split('\n')
+            for request in requests:
+                if request.strip() == '': continue
+                task = json.loads(request)
+                body = task.get('body', {})
+                lines.append(json.dumps({
+                    "id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": task['custom_id'],
+                    "response": { "status_code": 200, "request_id": uuid.uuid4().hex, "body": completion(job['model'] or body.get('model', ''), answer(body.get('messages', []))) },
+                    "error": None
+                }, ensure_ascii=False))
+            self.count('batch_requests', len(lines))
+            output = self.add_file(f"{batch_id}_output.jsonl", ('\n'.join(lines) + '\n').encode(), "batch_result")
+            with self.lock:
+                job['output'] = output['id']
+                job['total'] = len(lines)
+        return job
+
+
+def completion(model: str, text: str) -> dict:
+    """Chat completion object (same shape for OpenAI and MistralAI)."""
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}", "object": "chat.completion", "created": int(time.time()), "model": model,
+        "choices": [{ "index": 0, "message": { "role": "assistant", "content": text }, "finish_reason": "stop" }],
+        "usage": { "prompt_tokens": 0, "completion_tokens": len(text) // 4, "total_tokens": len(text) // 4 }
+    }
+
+
+def openai_batch(batch_id: str, job: dict) -> dict:
+    over = job['output'] is not None
+    return {
+        "id": batch_id, "object": "batch", "endpoint": job['endpoint'], "input_file_id": job['input_file'], "completion_window": "24h",
+        "status": "completed" if over else "in_progress", "output_file_id": job['output'], "error_file_id": None,
+        "created_at": int(job['created']), "metadata": job['metadata'],
+        "request_counts": { "total": job['total'], "completed": job['total'] if over else 0, "failed": 0 }
+    }
+
+
+def mistral_batch(batch_id: str, job: dict) -> dict:
+    over = job['output'] is not None
+    return {
+        "id": batch_id, "object": "batch", "input_files": [job['input_file']], "endpoint": job['endpoint'], "model": job['model'],
+        "metadata": job['metadata'], "errors": [], "status": "SUCCESS" if over else "RUNNING",
+        "created_at": int(job['created']), "output_file": job['output'], "error_file": None,
+        "total_requests": job['total'], "completed_requests": job['total'] if over else 0,
+        "succeeded_requests": job['total'] if over else 0, "failed_requests": 0
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stand_in: StandIn = None
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def send(self, status: int, content: dict | bytes, headers: dict = {}) -> None:
+        body = content if isinstance(content, bytes) else json.dumps(content, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream" if isinstance(content, bytes) else "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items(): self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def do_GET(self) -> None:
+        stand_in = self.stand_in
+        path = self.path.split('?')[0].rstrip('/')
+        if path == "/stats": return self.send(200, stand_in.stats)
+        if path in ["", "/api/version"]: return self.send(200, { "version": "stand-in" })
+
+        match = re.fullmatch(r'/v1/files/([^/]+)(/content)?', path)
+        if match and match.group(1) in stand_in.files:
+            infos, content = stand_in.files[match.group(1)]
+            return self.send(200, content if match.group(2) else infos)
+
+        match = re.fullmatch(r'/v1/(batches|batch/jobs)/([^/]+)', path)
+        if match and match.group(2) in stand_in.batches:
+            job = stand_in.batch_status(match.group(2))
+            return self.send(200, openai_batch(match.group(2), job) if match.group(1) == "batches" else mistral_batch(match.group(2), job))
+
+        self.send(404, { "error": { "message": f"Unknown path {path}" } })
+
+    def do_POST(self) -> None:
+        stand_in = self.stand_in
+        path = self.path.split('?')[0].rstrip('/')
+        body = self.read_body()
+        stand_in.count('requests')
+
+        # Chat: rate limit, failures and latency are simulated on them
+        if path in ["/v1/chat/completions", "/api/chat"]:
+            if stand_in.rate_limited():
+                stand_in.count('errors_429')
+                return self.send(429, { "error": { "message": "Rate limit exceeded (stand-in)" } }, { "Retry-After": "1" })
+            if stand_in.fails(body):
+                stand_in.count('errors_500')
+                return self.send(500, { "error": { "message": "Internal error (stand-in)" } })
+            time.sleep(stand_in.latency)
+            request = json.loads(body or b'{}')
+            if path == "/api/chat":
+                stand_in.count('ollama')
+                text = answer(request.get('messages', []), json_format=request.get('format') == 'json')
+                return self.send(200, {
+                    "model": request.get('model', ''), "created_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                    "message": { "role": "assistant", "content": text }, "done": True, "done_reason": "stop"
+                })
+            stand_in.count('chat')
+            json_format = (request.get('response_format') or {}).get('type') == 'json_object'
+            return self.send(200, completion(request.get('model', ''), answer(request.get('messages', []), json_format)))
+
+        # Files (multipart upload, same for OpenAI and MistralAI)
+        if path == "/v1/files":
+            message = email.parser.BytesParser().parsebytes(b"Content-Type: " + self.headers['Content-Type'].encode() + b"\r\n\r\n" + body)
+            name, content, purpose = "file.jsonl", b"", "batch"
+            for part in message.get_payload():
+                field = part.get_param('name', header='content-disposition')
+                if field == 'file': name, content = part.get_filename() or name, part.get_payload(decode=True)
+                if field == 'purpose': purpose = part.get_payload(decode=True).decode()
+            stand_in.count('files')
+            return self.send(200, stand_in.add_file(name, content, purpose))
+
+        # Batches
+        if path in ["/v1/batches", "/v1/batch/jobs"]:
+            request = json.loads(body)
+            input_file = request.get('input_file_id') or request['input_files'][0]
+            if input_file not in stand_in.files: return self.send(404, { "error": { "message": f"Unknown file {input_file}" } })
+            batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+            job = {
+                "created": time.time(), "input_file": input_file, "endpoint": request.get('endpoint', '/v1/chat/completions'),
+                "model": request.get('model'), "metadata": request.get('metadata'), "output": None,
+                "total": stand_in.files[input_file][0]['num_lines']
+            }
+            with stand_in.lock:
+                stand_in.batches[batch_id] = job
+            stand_in.count('batches')
+            return self.send(200, openai_batch(batch_id, job) if path == "/v1/batches" else mistral_batch(batch_id, job))
+
+        self.send(404, { "error": { "message": f"Unknown path {path}" } })
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds to answer a chat request')
+    parser.add_argument('--failure-rate', type=float, default=0, help='part of chat requests failing with a 500 error')
+    parser.add_argument('--rate-limit', type=float, default=None, help='chat requests per second, beyond which a 429 error is sent')
+    parser.add_argument('--batch-latency', type=float, default=2, help='seconds for a batch to be over')
+    args = parser.parse_args()
+
+    Handler.stand_in = StandIn(args.latency, args.failure_rate, args.rate_limit, args.batch_latency)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), Handler)
+    print(f'Stand-in LLM server on http://127.0.0.1:{args.port}', flush=True)
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
@@ -0,0 +1,27 @@
+import argparse
+from cache import VerdictMemo
+
+# Manage the verdicts of the local model kept by 20-verify and 22-authors (see cache.VerdictMemo)
+# Usage: python verdicts.py forget <value> [--field material_technique]
+#        python verdicts.py stats [--top 20]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    forget_parser = subparsers.add_parser('forget', help='remove the verdicts of a value, so that it is asked again')
+    forget_parser.add_argument('value')
+    forget_parser.add_argument('--field', choices=['object_type', 'material_technique', 'origin', 'author'])
+    stats_parser = subparsers.add_parser('stats', help='number of verdicts, and values most often confirmed')
+    stats_parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    memo = VerdictMemo()
+    if args.command == 'forget':
+        print(f'{memo.forget(args.value, args.field)} verdicts removed for "{args.value}"' + (f' ({args.field})' if args.field else ''))
+
+    if args.command == 'stats':
+        nb_verdicts, nb_yes = memo.connection.execute("SELECT COUNT(*), COALESCE(SUM(verdict), 0) FROM verdicts").fetchone()
+        print(f'{nb_verdicts} verdicts, {nb_yes} confirmations')
+        for (field, value), count in sorted(memo.confirmations.items(), key=lambda item: -item[1])[:args.top]:
+            print(f'{count:>6}  {field:<20}{value}')
+    memo.close()